@@ -0,0 +1,285 @@
+"""
+ Micro benchmarks of the progresscsv.py table pipeline on synthetic
+ progress csv files (see synthcsv.py) at several data sizes
+
+ Benchmarks:
+
+ parse: read_progress_csv of every run file
+ summary: append_summary of the run files and stack_tables
+ stats: tablecol_unique_info of the --stats columns
+ fits: write_table of the summary table
+ plot_radec, plot_raextime: the two progress plots
+ plot_radec_density, plot_raextime_density: the plots with --density
+
+ Each benchmark is run --repeat times and the best and median times
+ are kept. The results are written to a json file so that runs on
+ different versions can be compared; --compare prints the ratio of
+ the best times to a previous results file and flags regressions.
+
+ Usage:
+
+ python bench_micro.py --sizes 10000,100000,1000000 --json micro.json
+
+ python bench_micro.py --sizes 10000,100000 --compare micro.json
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+import progresscsv
+import synthcsv
+
+
+BENCHMARKS = ['parse', 'summary', 'stats', 'fits', 'plot_radec',
+              'plot_raextime', 'plot_radec_density',
+              'plot_raextime_density']
+
+STATS_COLUMNS = ['run ID', 'OB ID', 'OB status', 'Status date', 'OB name',
+                 'OD name', 'Execution time (s)', 'Container type',
+                 'Container ID', 'Seeing', 'Sky transparency', 'FLI']
+
+
+class _Quiet(object):
+    """
+    discard the progresscsv print output
+
+    """
+    def __enter__(self):
+        import os
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def timeit(func, repeat=3):
+    """
+    time func repeat times
+
+    returns the list of times and the result of the last call
+
+    """
+    times = []
+    for i in range(repeat):
+        t0 = time.time()
+        result = func()
+        times.append(time.time() - t0)
+
+    return times, result
+
+
+def bench_size(nrows, runs, workdir, repeat=3):
+    """
+    run the benchmarks on nrows OBs split between runs
+
+    returns a dict of benchmark: {times, best, median, rows_per_s}
+
+    """
+    import os
+    import numpy as np
+
+    program = '198A2001'
+    datadir = os.path.join(workdir, str(nrows))
+    if not os.path.isdir(datadir):
+        print('Generating:', nrows, 'rows in', datadir)
+        synthcsv.write_program(datadir, program, runs, nrows)
+    runfiles = [os.path.join(datadir, program + run + '.csv')
+                for run in runs]
+    results = {}
+
+    def _parse():
+        return [progresscsv.read_progress_csv(runfile)
+                for runfile in runfiles]
+
+    def _summary():
+        fh = progresscsv.open_summary(os.path.join(datadir, 'summary.csv'))
+        for runfile in runfiles:
+            with open(runfile) as runfh:
+                progresscsv.append_summary(fh, runfh.readlines())
+        progresscsv.close_summary(fh, os.path.join(datadir, 'summary.csv'))
+        return progresscsv.stack_tables(tables)
+
+    def _stats():
+        return progresscsv.tablecol_unique_info(table, STATS_COLUMNS,
+                                                counts=False)
+
+    def _fits():
+        progresscsv.write_table(table, os.path.join(datadir, 'summary.fits'))
+
+    def _plot_radec(density=False):
+        progresscsv.plot_radec(table['RA (hrs)'], table['DEC (deg)'],
+                               figfile=os.path.join(datadir, 'radec.png'),
+                               rarange=[0.0, 24.0], decrange=[-90.0, 10.0],
+                               status=table['OB status'], density=density)
+
+    def _plot_raextime(density=False):
+        progresscsv.plot_raextime(table['RA (hrs)'],
+                                  table['Execution time (s)'],
+                                  figfile=os.path.join(datadir,
+                                                       'raextime.png'),
+                                  rarange=[0.0, 24.0],
+                                  status=table['OB status'],
+                                  density=density)
+
+    with _Quiet():
+        times, tables = timeit(_parse, repeat)
+        results['parse'] = times
+        times, table = timeit(_summary, repeat)
+        results['summary'] = times
+        for name, func in [('stats', _stats), ('fits', _fits),
+                           ('plot_radec', _plot_radec),
+                           ('plot_raextime', _plot_raextime),
+                           ('plot_radec_density',
+                            lambda: _plot_radec(density=True)),
+                           ('plot_raextime_density',
+                            lambda: _plot_raextime(density=True))]:
+            results[name] = timeit(func, repeat)[0]
+
+    for name in results:
+        times = results[name]
+        results[name] = {'times': times, 'best': min(times),
+                         'median': float(np.median(times)),
+                         'rows_per_s': nrows / max(min(times), 1e-9)}
+
+    return results
+
+
+def compare(results, oldresults, threshold=1.1):
+    """
+    print the ratio of the best times to those of a previous results
+    file; ratios above threshold are flagged as regressions
+
+    returns the number of regressions
+
+    """
+    nregressions = 0
+    print()
+    print('Compared with:', oldresults.get('date'),
+          oldresults.get('version', ''))
+    print('%-10s %-22s %9s %9s %7s' % ('size', 'benchmark', 'old', 'new',
+                                       'ratio'))
+    for size in sorted(results['sizes'], key=int):
+        old = oldresults['sizes'].get(size)
+        if old is None:
+            continue
+        for name in BENCHMARKS:
+            if name not in old or name not in results['sizes'][size]:
+                continue
+            oldbest = old[name]['best']
+            newbest = results['sizes'][size][name]['best']
+            ratio = newbest / max(oldbest, 1e-9)
+            flag = ''
+            if ratio > threshold:
+                flag = 'REGRESSION'
+                nregressions += 1
+            print('%-10s %-22s %9.3f %9.3f %7.2f %s' %
+                  (size, name, oldbest, newbest, ratio, flag))
+
+    return nregressions
+
+
+def getargs():
+    """
+    parse command line arguements
+
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='micro benchmarks of the progresscsv.py table ' +
+        'pipeline on synthetic progress csv files',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--sizes", default='10000,100000',
+                        help="comma separated numbers of OBs")
+
+    parser.add_argument("--runs", default='A-O',
+                        help="runs to split the OBs between e.g. A-O")
+
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of repeats of each benchmark")
+
+    parser.add_argument("--workdir",
+                        help="directory for the synthetic csv files; " +
+                        "kept for reuse if given, otherwise temporary")
+
+    parser.add_argument("--json",
+                        help="write the results to this json file")
+
+    parser.add_argument("--compare",
+                        help="compare with a previous json results file")
+
+    parser.add_argument("--threshold", type=float, default=1.1,
+                        help="new/old time ratio flagged as a regression " +
+                        "by --compare")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    import json
+    import shutil
+    import platform
+    import subprocess
+    import tempfile
+
+    import numpy
+    import astropy
+
+    args = getargs()
+    runs = synthcsv.run_range(args.runs)
+
+    workdir = args.workdir
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='bench_micro_')
+
+    try:
+        version = subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        version = ''
+
+    results = {'date': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()),
+               'version': version,
+               'python': platform.python_version(),
+               'numpy': numpy.__version__,
+               'astropy': astropy.__version__,
+               'runs': len(runs),
+               'repeat': args.repeat,
+               'sizes': {}}
+
+    try:
+        for size in args.sizes.split(','):
+            nrows = int(size)
+            results['sizes'][str(nrows)] = bench_size(nrows, runs, workdir,
+                                                      repeat=args.repeat)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+    print('%-10s %-22s %9s %9s %12s' % ('size', 'benchmark', 'best',
+                                        'median', 'rows/s'))
+    for size in sorted(results['sizes'], key=int):
+        for name in BENCHMARKS:
+            result = results['sizes'][size][name]
+            print('%-10s %-22s %9.3f %9.3f %12.4g' %
+                  (size, name, result['best'], result['median'],
+                   result['rows_per_s']))
+
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+        print('Results written to', args.json)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            oldresults = json.load(fh)
+        if compare(results, oldresults, threshold=args.threshold) > 0:
+            sys.exit(1)
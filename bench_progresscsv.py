@@ -0,0 +1,225 @@
+"""
+ End to end benchmark of progresscsv.py against the local fakeeso.py
+ ESO portal so that performance changes can be measured offline
+
+ Each repeat starts a FakeESO in a thread, logs in and runs
+ progresscsv.process_program (with --stats) into a temporary outpath
+ root, waits for the detached plot stage and then runs process_program
+ again for the next day with no run file changed. The stage timings
+ are the ones process_program returns (see progresscsv.write_metrics)
+ plus the wall time of the plot stage (plotstage) and the total time
+ of the second, no change, run (nochange). The best and median time of
+ each stage and the throughput in bytes or rows per second are printed
+ and optionally written to a json file.
+
+ Usage:
+
+ python bench_progresscsv.py --runs A-O --nrows 2000 --repeat 3
+
+ Options:
+
+ --latency: seconds added by the server to every run file request
+ --json: write the results to a json file
+ --verbose: show the progresscsv output
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+import progresscsv
+import fakeeso
+import synthcsv
+
+
+STAGES = ['login', 'fetch', 'parse', 'fits', 'tables', 'delta', 'stats',
+          'plots', 'store', 'total', 'plotstage', 'nochange']
+
+
+class _Quiet(object):
+    """
+    discard the progresscsv print output of a stage
+
+    """
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def __enter__(self):
+        import os
+        if not self.verbose:
+            self.stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        if not self.verbose:
+            sys.stdout.close()
+            sys.stdout = self.stdout
+
+
+def _progress_args(nworkers):
+    """
+    the progresscsv command line arguments of the benchmark; the runs
+    are never closed so that every run file is requested
+
+    """
+    argv = sys.argv
+    sys.argv = ['progresscsv.py', '--stats', '--nworkers', str(nworkers),
+                '--closed-days', '1e9']
+    try:
+        return progresscsv.getargs()
+    finally:
+        sys.argv = argv
+
+
+def run_once(program, runs, nrows, latency=0.0, nworkers=8, verbose=False):
+    """
+    run process_program twice against a new FakeESO; see the module
+    docstring
+
+    returns a dict of the elapsed time of each stage and the number of
+    bytes and rows processed
+
+    """
+    import shutil
+    import tempfile
+
+    server = fakeeso.start_server(programs=[program], runs=runs,
+                                  nrows=nrows, latency=latency,
+                                  username='bench', password='bench')
+    progresscsv.set_eso_url(server.url)
+    progresscsv.USERNAME = 'bench'
+    progresscsv.PASSWORD = 'bench'
+
+    outpath_root = tempfile.mkdtemp(prefix='bench_progresscsv_')
+    try:
+        with _Quiet(verbose):
+            args = _progress_args(nworkers)
+
+            t0 = time.time()
+            opener = progresscsv.login()
+            tlogin = time.time() - t0
+
+            timings = progresscsv.process_program(
+                opener, program, outpath_root, args, '20190101',
+                login=tlogin)
+
+            t0 = time.time()
+            for process in progresscsv.PLOT_PROCESSES:
+                process.wait()
+            timings['plotstage'] = time.time() - t0
+
+            nochange = progresscsv.process_program(
+                opener, program, outpath_root, args, '20190102', login=0.0)
+            timings['nochange'] = nochange['total']
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(outpath_root)
+
+    return timings
+
+
+def summarise(results):
+    """
+    best and median time of each stage over the repeats with the
+    throughput of the best time
+
+    """
+    import numpy as np
+
+    nbytes = results[0]['nbytes']
+    nrows = results[0]['nrows']
+    summary = {}
+    for stage in STAGES:
+        times = [result.get(stage, 0.0) for result in results]
+        best = min(times)
+        summary[stage] = {'times': times, 'best': best,
+                          'median': float(np.median(times))}
+        if stage == 'fetch':
+            summary[stage]['bytes_per_s'] = nbytes / best
+        elif stage in ('parse', 'fits', 'stats', 'plotstage'):
+            summary[stage]['rows_per_s'] = nrows / best
+
+    return summary
+
+
+def getargs():
+    """
+    parse command line arguements
+
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='end to end benchmark of progresscsv.py against ' +
+        'fakeeso.py',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--program", default='198A2001',
+                        help="program ID")
+
+    parser.add_argument("--runs", default='A-O',
+                        help="runs e.g. A-O or A-Z,AA,AB")
+
+    parser.add_argument("--nrows", type=int, default=2000,
+                        help="number of OBs in each run file")
+
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every run file request")
+
+    parser.add_argument("--nworkers", type=int, default=8,
+                        help="number of concurrent run file downloads")
+
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of repeats")
+
+    parser.add_argument("--json",
+                        help="write the results to this json file")
+
+    parser.add_argument("--verbose", action='store_true',
+                        help="show the progresscsv output")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    import json
+    import platform
+
+    args = getargs()
+    runs = synthcsv.run_range(args.runs)
+
+    results = []
+    for i in range(args.repeat):
+        results.append(run_once(args.program, runs, args.nrows,
+                                latency=args.latency,
+                                nworkers=args.nworkers,
+                                verbose=args.verbose))
+    summary = summarise(results)
+
+    print('runs:', len(runs), 'rows:', results[0]['nrows'],
+          'bytes:', results[0]['nbytes'], 'repeats:', args.repeat)
+    print('%-9s %9s %9s %14s' % ('stage', 'best', 'median', 'throughput'))
+    for stage in STAGES:
+        throughput = ''
+        if 'bytes_per_s' in summary[stage]:
+            throughput = '%.3g B/s' % summary[stage]['bytes_per_s']
+        elif 'rows_per_s' in summary[stage]:
+            throughput = '%.3g rows/s' % summary[stage]['rows_per_s']
+        print('%-9s %9.3f %9.3f %14s' % (stage, summary[stage]['best'],
+                                          summary[stage]['median'],
+                                          throughput))
+
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump({'date': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                             time.gmtime()),
+                       'python': platform.python_version(),
+                       'params': vars(args),
+                       'nrows': results[0]['nrows'],
+                       'nbytes': results[0]['nbytes'],
+                       'stages': summary}, fh, indent=2, sort_keys=True)
+        print('Results written to', args.json)
@@ -0,0 +1,415 @@
+"""
+ Local stand-in for the parts of the ESO portal used by progresscsv.py
+
+ Serves the SSO login page with the hidden execution token, the login
+ POST (which on the real portal fails with a 404 but still logs you
+ in), the welcome2.eso page used to check a saved session and the
+ status_pl/csv/<program><run>.csv run files with ETag and
+ Last-Modified, conditional requests, HEAD and gzip. Latency and
+ failures can be injected so that progresscsv.py can be exercised and
+ benchmarked without ESO credentials or network access.
+
+ Usage:
+
+ python fakeeso.py --port 8765 --program 198A2001 --runs A-O --nrows 2000
+
+ and in the [vhs] section of progresscsv.cfg:
+
+ esourl = http://127.0.0.1:8765
+ username = fake
+ password = fake
+
+ Options:
+
+ --latency: seconds added to every run file request
+ --fail: probability that a run file request fails with http 503
+ --login200: answer the login POST with the Logout page rather than
+   the 404 of the real portal
+ --nohead: answer HEAD requests with http 405
+
+ Control endpoints for tests:
+
+ /_fake/stats          request counts as json
+ /_fake/expire         expire all the sessions
+ /_fake/touch/<file>   add rows to a run file so it changes e.g.
+                       /_fake/touch/198A2001N?nrows=10
+
+ The run files are made by synthcsv.py. See also bench_progresscsv.py
+
+"""
+
+from __future__ import print_function
+
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import synthcsv
+
+
+class RunFile(object):
+    """
+    a run file served by FakeESO with its validators and gzip body
+
+    """
+
+    def __init__(self, program, run, nrows, last_modified):
+        self.program = program
+        self.run = run
+        self.preamble, self.lines = synthcsv.make_runfile(program, run,
+                                                          nrows)
+        self.update(last_modified)
+
+    def touch(self, nrows, last_modified):
+        """
+        add nrows OBs so that the run file changes
+
+        """
+        self.lines += synthcsv.make_rows(self.program, self.run, nrows,
+                                         seed=last_modified,
+                                         start=len(self.lines))
+        self.update(last_modified)
+
+    def update(self, last_modified):
+        import gzip
+        import hashlib
+        import StringIO
+        from email.utils import formatdate
+
+        self.body = ''.join(self.preamble + self.lines)
+        self.etag = '"%s"' % hashlib.md5(self.body).hexdigest()
+        self.mtime = int(last_modified)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        buf = StringIO.StringIO()
+        fh = gzip.GzipFile(fileobj=buf, mode='wb')
+        fh.write(self.body)
+        fh.close()
+        self.gzbody = buf.getvalue()
+
+
+class FakeESO(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    threaded http server holding the run files and sessions
+
+    """
+    daemon_threads = True
+
+    def __init__(self, address, programs, runs, nrows=2000,
+                 username='fake', password='fake', latency=0.0, fail=0.0,
+                 login404=True, nohead=False, last_modified=1546300800):
+        # server_close is called by HTTPServer.__init__ if the bind
+        # fails e.g. the port is in use
+        self.lock = threading.Lock()
+        self.connections = set()
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeESOHandler)
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.fail = fail
+        self.login404 = login404
+        self.nohead = nohead
+
+        self.runfiles = {}
+        for program in programs:
+            for run in runs:
+                self.runfiles[program + run] = RunFile(program, run, nrows,
+                                                       last_modified)
+
+        self.tokens = set()
+        self.sessions = set()
+        self.counts = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request,
+                                                    client_address)
+
+    def shutdown_request(self, request):
+        with self.lock:
+            self.connections.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def server_close(self):
+        """
+        close the listening socket and the keep-alive connections so
+        the handler threads finish
+
+        """
+        BaseHTTPServer.HTTPServer.server_close(self)
+        with self.lock:
+            connections = list(self.connections)
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class FakeESOHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    request handler for FakeESO
+
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, code, body='', headers=()):
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def base_url(self):
+        return 'http://' + self.headers.getheader('Host', 'localhost')
+
+    def session(self):
+        import Cookie
+
+        cookie = Cookie.SimpleCookie(self.headers.getheader('Cookie', ''))
+        if 'TGC' in cookie and cookie['TGC'].value in self.server.sessions:
+            return cookie['TGC'].value
+        return None
+
+    def login_page(self, message=''):
+        import uuid
+
+        token = uuid.uuid4().hex
+        with self.server.lock:
+            self.server.tokens.add(token)
+        body = ('<html><body>%s<form method="post" action="/sso/login">' +
+                '<input type="hidden" name="execution" value="%s"/>' +
+                '</form></body></html>') % (message, token)
+        self.send(200, body, [('Content-Type', 'text/html'),
+                              ('Set-Cookie', 'JSESSIONID=%s; Path=/' %
+                               uuid.uuid4().hex)])
+
+    def logout_page(self):
+        return ('<html><body><a href="%s/UserPortal/authenticatedArea/' +
+                'logout.eso">Logout</a></body></html>') % self.base_url()
+
+    def do_HEAD(self):
+        if self.server.nohead:
+            self.server.count('head_405')
+            self.send(405, 'Method Not Allowed')
+            return
+        self.do_GET()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+
+        if path == '/sso/login':
+            self.server.count('login_page')
+            self.login_page()
+        elif path == '/UserPortal/authenticatedArea/welcome2.eso':
+            self.server.count('session_check')
+            if self.session() is None:
+                self.login_page()
+            else:
+                self.send(200, self.logout_page(),
+                          [('Content-Type', 'text/html')])
+        elif path.startswith('/observing/usg/status_pl/csv/'):
+            self.runfile(path.rsplit('/', 1)[1])
+        elif path.startswith('/_fake/'):
+            self.control(path)
+        else:
+            self.send(404, 'Not Found')
+
+    def do_POST(self):
+        import uuid
+        import urlparse
+
+        length = int(self.headers.getheader('Content-Length') or 0)
+        form = dict(urlparse.parse_qsl(self.rfile.read(length)))
+        if self.path.split('?')[0] != '/sso/login':
+            self.send(404, 'Not Found')
+            return
+
+        self.server.count('login')
+        with self.server.lock:
+            valid = form.get('execution') in self.server.tokens
+            self.server.tokens.discard(form.get('execution'))
+        if not valid or form.get('username') != self.server.username or \
+                form.get('password') != self.server.password:
+            self.login_page(message='Invalid credentials')
+            return
+
+        ticket = uuid.uuid4().hex
+        with self.server.lock:
+            self.server.sessions.add(ticket)
+        headers = [('Set-Cookie', 'TGC=%s; Path=/' % ticket)]
+        if self.server.login404:
+            # the real portal logs you in and then fails with a 404
+            self.send(404, 'Not Found', headers)
+        else:
+            self.send(200, self.logout_page(),
+                      headers + [('Content-Type', 'text/html')])
+
+    def runfile(self, filename):
+        import time
+        import random
+
+        self.server.count('csv_' + self.command.lower())
+        if self.session() is None:
+            self.send(302, '', [('Location', self.base_url() +
+                                 '/sso/login?service=csv')])
+            return
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.fail:
+            self.server.count('csv_503')
+            self.send(503, 'Service Unavailable')
+            return
+
+        with self.server.lock:
+            runfile = self.server.runfiles.get(filename[:-len('.csv')])
+        if not filename.endswith('.csv') or runfile is None:
+            self.send(404, 'Not Found')
+            return
+
+        headers = [('ETag', runfile.etag),
+                   ('Last-Modified', runfile.last_modified)]
+        if self.headers.getheader('If-None-Match') == runfile.etag or \
+                (self.headers.getheader('If-None-Match') is None and
+                 self.headers.getheader('If-Modified-Since') ==
+                 runfile.last_modified):
+            self.server.count('csv_304')
+            self.send(304, '', headers)
+            return
+
+        body = runfile.body
+        headers.append(('Content-Type', 'text/csv'))
+        if 'gzip' in self.headers.getheader('Accept-Encoding', ''):
+            body = runfile.gzbody
+            headers.append(('Content-Encoding', 'gzip'))
+        self.send(200, body, headers)
+
+    def control(self, path):
+        import json
+        import time
+        import urlparse
+
+        query = dict(urlparse.parse_qsl(urlparse.urlparse(self.path).query))
+        if path == '/_fake/stats':
+            with self.server.lock:
+                body = json.dumps(self.server.counts, sort_keys=True)
+            self.send(200, body, [('Content-Type', 'application/json')])
+        elif path == '/_fake/expire':
+            with self.server.lock:
+                self.server.sessions.clear()
+            self.send(200, 'expired')
+        elif path.startswith('/_fake/touch/'):
+            name = path.rsplit('/', 1)[1]
+            with self.server.lock:
+                runfile = self.server.runfiles.get(name)
+                if runfile is not None:
+                    runfile.touch(int(query.get('nrows', 1)),
+                                  max(time.time(), runfile.mtime + 1))
+            if runfile is None:
+                self.send(404, 'Not Found')
+            else:
+                self.send(200, runfile.etag)
+        else:
+            self.send(404, 'Not Found')
+
+
+def start_server(port=0, background=True, **kwargs):
+    """
+    start a FakeESO on localhost; port 0 picks a free port
+
+    With background the server runs in a daemon thread and is returned
+    (see FakeESO.url and shutdown) otherwise it serves until
+    interrupted.
+
+    """
+    server = FakeESO(('127.0.0.1', port), **kwargs)
+    if not background:
+        print('Serving on', server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        return server
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+def getargs():
+    """
+    parse command line arguements
+
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='local stand-in for the ESO portal used by ' +
+        'progresscsv.py',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--port", type=int, default=8765,
+                        help="port to listen on")
+
+    parser.add_argument("--program", action='append', default=[],
+                        help="program ID; may be repeated " +
+                        "(default 198A2001)")
+
+    parser.add_argument("--runs", default='A-O',
+                        help="runs of each program e.g. A-O or A-Z,AA,AB")
+
+    parser.add_argument("--nrows", type=int, default=2000,
+                        help="number of OBs in each run file")
+
+    parser.add_argument("--username", default='fake',
+                        help="ESO username")
+
+    parser.add_argument("--password", default='fake',
+                        help="ESO password")
+
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every run file request")
+
+    parser.add_argument("--fail", type=float, default=0.0,
+                        help="probability of a http 503 for a run file " +
+                        "request")
+
+    parser.add_argument("--login200", action='store_true',
+                        help="answer the login POST with the Logout page " +
+                        "rather than a 404")
+
+    parser.add_argument("--nohead", action='store_true',
+                        help="answer HEAD requests with http 405")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    args = getargs()
+
+    start_server(port=args.port, background=False,
+                 programs=args.program or ['198A2001'],
+                 runs=synthcsv.run_range(args.runs), nrows=args.nrows,
+                 username=args.username, password=args.password,
+                 latency=args.latency, fail=args.fail,
+                 login404=not args.login200, nohead=args.nohead)
@@ -13,15 +13,14 @@
  Each period csv file is copied and a FITs file is created. A summary
  csv and FITs format file is also created by appending all the files.
 
- Appending the fits files is by reading back the appended csv file
- to get around fact that number of characters per column is
- different in each file and the in memory version has fixed char
- width columns.
+ The summary FITs file is made by stacking the per period tables
+ after casting the columns to a common dtype since the number of
+ characters per column is different in each file and the in memory
+ version has fixed char width columns.
 
 
  TODO:
  convert to astropy
- make it smart enough to iterate on the RUNS A. B etc
 
 
  Usage:
@@ -34,6 +33,10 @@
 
  You may need to customise some of the login and program information
 
+ The ESO portal can be replaced by the local fakeeso.py with the config
+ file option esourl e.g. esourl = http://127.0.0.1:8765; see also
+ bench_progresscsv.py
+
 Was of the form:
 http://www.eso.org/observing/usg/status_pl/run/179A2010C.csv
 
@@ -68,12 +71,59 @@ try:
 except NameError:
     pass
 
+import socket
+import threading
+import httplib
+import urllib2
+
+
+# ESO portal URLs; see set_eso_url to use another server e.g. fakeeso.py
+ESO_URL = "https://www.eso.org"
+SERVICE_URL = "https://www.eso.org:443/UserPortal/security_check"
+CSV_URL = "http://www.eso.org/observing/usg/status_pl/csv/"
+
+# column schema of the ESO progress csv files; (column name, numpy
+# dtype) with 'S' for a string column sized to the longest value.
+# Bump SCHEMA_VERSION when the schema changes.
+SCHEMA_VERSION = 1
+PROGRESS_SCHEMA = [
+    ('run ID', 'S'),
+    ('OB ID', 'i8'),
+    ('OB name', 'S'),
+    ('OB status', 'S'),
+    ('Status date', 'M8[s]'),
+    ('OD name', 'S'),
+    ('RA (hrs)', 'f8'),
+    ('DEC (deg)', 'f8'),
+    ('Execution time (s)', 'f8'),
+    ('Container type', 'S'),
+    ('Container ID', 'i8'),
+    ('Seeing', 'f8'),
+    ('Sky transparency', 'S'),
+    ('FLI', 'f8'),
+]
+
+
+def set_eso_url(url):
+    """
+    use the ESO portal at url rather than www.eso.org e.g.
+    http://127.0.0.1:8765 for fakeeso.py; config file option esourl
+
+    """
+    global ESO_URL, SERVICE_URL, CSV_URL
+
+    url = url.rstrip('/')
+    ESO_URL = url
+    SERVICE_URL = url + "/UserPortal/security_check"
+    CSV_URL = url + "/observing/usg/status_pl/csv/"
+
 
 def _check_perms(fname):
     """
     make sure the password file is not world readable
 
     """
+    import os
     import stat
     fname = os.path.expanduser(fname)
     with open(fname) as fobj:
@@ -84,12 +134,193 @@ def _check_perms(fname):
                 raise IOError(err)
 
 
-def login(verbose=False, debug=False, pause=False):
+class _PooledResponse(object):
+    """
+    wrapper for a httplib response that hands the connection back to
+    the pool of the handler once the body has been read and closed
+
+    """
+    def __init__(self, handler, key, conn, response):
+        self._handler = handler
+        self._key = key
+        self._conn = conn
+        self._response = response
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    recv = read
+
+    def close(self):
+        if self._conn is None:
+            return
+        response = self._response
+        # drain small unread bodies e.g. from 304 and 404 responses so
+        # that the connection can be reused
+        if not response.isclosed() and response.length is not None \
+                and response.length < 65536:
+            try:
+                response.read()
+            except (socket.error, httplib.HTTPException):
+                pass
+        if response.isclosed() and not response.will_close:
+            self._handler._release(self._key, self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+
+class _KeepAliveMixin(object):
+    """
+    urllib2 handler mixin that keeps a pool of persistent HTTP/1.1
+    connections per host instead of opening a new connection (and TLS
+    handshake) for every request. Connections are taken out of the pool
+    for the duration of a request so the handler can be shared by
+    threads.
+
+    """
+    def _pool_init(self):
+        self._pool = {}
+        self._pool_lock = threading.Lock()
+
+    def _acquire(self, key):
+        with self._pool_lock:
+            idle = self._pool.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _release(self, key, conn):
+        with self._pool_lock:
+            self._pool.setdefault(key, []).append(conn)
+
+    def close_all(self):
+        with self._pool_lock:
+            for idle in self._pool.values():
+                for conn in idle:
+                    conn.close()
+            self._pool = {}
+
+    def _keepalive_open(self, http_class, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers["Connection"] = "keep-alive"
+        headers = dict(
+            (name.title(), val) for name, val in headers.items())
+
+        key = (http_class, host)
+        conn = self._acquire(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = http_class(host, timeout=req.timeout)
+                conn.set_debuglevel(self._debuglevel)
+            try:
+                conn.request(req.get_method(), req.get_selector(),
+                             req.data, headers)
+                r = conn.getresponse(buffering=True)
+                break
+            except (socket.error, httplib.HTTPException) as err:
+                conn.close()
+                conn = None
+                if not reused:
+                    raise urllib2.URLError(err)
+                # the server closed the idle pooled connection; retry
+                # once on a new connection
+                reused = False
+
+        fp = socket._fileobject(_PooledResponse(self, key, conn, r),
+                                close=True)
+        resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+
+class KeepAliveHTTPHandler(_KeepAliveMixin, urllib2.HTTPHandler):
+
+    def __init__(self, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self._pool_init()
+
+    def http_open(self, req):
+        return self._keepalive_open(httplib.HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(_KeepAliveMixin, urllib2.HTTPSHandler):
+
+    def __init__(self, debuglevel=0):
+        urllib2.HTTPSHandler.__init__(self, debuglevel)
+        self._pool_init()
+
+    def https_open(self, req):
+        return self._keepalive_open(httplib.HTTPSConnection, req)
+
+
+def build_opener(cookiejar):
+    """
+    urllib2 opener with the cookie jar and pooled keep-alive connections
+
+    """
+    return urllib2.build_opener(urllib2.HTTPCookieProcessor(cookiejar),
+                                KeepAliveHTTPHandler(),
+                                KeepAliveHTTPSHandler())
+
+
+def is_transient(err):
+    """
+    True if a failed request is worth retrying i.e. a network problem
+    or a server side error rather than e.g. a run file that does not
+    exist (404)
+
+    """
+    if isinstance(err, urllib2.HTTPError):
+        return err.code in (408, 429, 500, 502, 503, 504)
+    return isinstance(err, (urllib2.URLError, socket.error,
+                            httplib.HTTPException))
+
+
+def with_retries(func, retries=4, backoff=0.5, maxbackoff=30.0,
+                 debug=False):
+    """
+    call func() retrying transient errors (see is_transient) up to
+    retries times with exponential backoff and full jitter i.e. a random
+    wait between zero and backoff * 2**attempt seconds
+
+    """
+    import time
+    import random
+
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as err:
+            if attempt >= retries or not is_transient(err):
+                raise
+            wait = random.uniform(0.0, min(maxbackoff,
+                                           backoff * 2 ** attempt))
+            attempt += 1
+            print('Transient error:', err, '- retry', attempt,
+                  'of', retries, 'in %.1f seconds' % wait)
+            time.sleep(wait)
+
+
+def login(verbose=False, debug=False, pause=False, cookiejar=None):
     """
     #updated login process (dmurphy, 17/4/19)
 
     uses urllib2
 
+    cookiejar: optional cookielib.CookieJar to hold the session cookies,
+    e.g. a FileCookieJar so that the session can be saved; see
+    login_session
+
     From: https://docs.python.org/2/library/urllib2.html
 
     The urllib2 module defines functions and classes which help in opening
@@ -104,6 +335,7 @@ def login(verbose=False, debug=False, pause=False):
 
     """
 
+    import re
     import urllib
     import urllib2
     import cookielib
@@ -111,8 +343,8 @@ def login(verbose=False, debug=False, pause=False):
     # Set request to login to the archive
     # Convert a mapping object or a sequence of two-element tuples to
     # a "percent-encoded" string, suitable to pass to urlopen()
-    URLLOGIN = "https://www.eso.org/sso/login"
-    dd = {"service": "https://www.eso.org:443/UserPortal/security_check"}
+    URLLOGIN = ESO_URL + "/sso/login"
+    dd = {"service": SERVICE_URL}
     q = "%s?%s" % (URLLOGIN, urllib.urlencode(dd))
     if verbose or debug:
         print('urllib q:', q)
@@ -123,7 +355,9 @@ def login(verbose=False, debug=False, pause=False):
     request = urllib2.Request(q)
 
     # Read cookies
-    cj = cookielib.CookieJar()
+    cj = cookiejar
+    if cj is None:
+        cj = cookielib.CookieJar()
     cj.extract_cookies(response, request)
 
     if debug:
@@ -131,7 +365,7 @@ def login(verbose=False, debug=False, pause=False):
     if debug and pause:
         raw_input("Press ENTER to continue: ")
 
-    opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
+    opener = build_opener(cj)
 
     # Extract token
     buffer = response.read()
@@ -146,7 +380,7 @@ def login(verbose=False, debug=False, pause=False):
     dd = {'execution': token,
           "username": USERNAME, "password": PASSWORD,
           "_eventId": "submit",
-          "service": "https://www.eso.org:443/UserPortal/security_check"}
+          "service": SERVICE_URL}
 
     newd = []
     for k, v in dd.items():
@@ -169,7 +403,7 @@ def login(verbose=False, debug=False, pause=False):
         print('Found a 404 - ESO should fix this (you should still be logged in, however)!')
         return opener
     else:
-        if res.find("""<a href="https://www.eso.org/UserPortal/authenticatedArea/logout.eso">Logout</a>""") > 0:
+        if res.find("""<a href="%s/UserPortal/authenticatedArea/logout.eso">Logout</a>""" % ESO_URL) > 0:
             print('Log In Successful')
             return opener
         else:
@@ -178,6 +412,65 @@ def login(verbose=False, debug=False, pause=False):
     return
 
 
+def login_session(sessionfile, relogin=False,
+                  verbose=False, debug=False, pause=False):
+    """
+    reuse a saved ESO SSO session if it is still valid otherwise login
+
+    The session cookies are kept in sessionfile which contains
+    credentials so like the config file it must not be group or world
+    readable; see _check_perms. The saved session is validated with a
+    single request for the portal welcome page which only shows the
+    Logout link to an authenticated user.
+
+    returns an opener with the session cookies
+
+    """
+    import os
+    import cookielib
+
+    URLCHECK = ESO_URL + "/UserPortal/authenticatedArea/welcome2.eso"
+
+    sessionfile = os.path.expanduser(sessionfile)
+    cj = cookielib.LWPCookieJar(sessionfile)
+
+    if os.path.exists(sessionfile) and not relogin:
+        _check_perms(sessionfile)
+        try:
+            # session cookies are flagged discard so keep them
+            cj.load(ignore_discard=True)
+        except (IOError, cookielib.LoadError) as err:
+            print('Ignoring unreadable session file:', sessionfile, err)
+            cj.clear()
+
+        if len(cj) > 0:
+            opener = build_opener(cj)
+            try:
+                page = with_retries(lambda: opener.open(URLCHECK).read(),
+                                    debug=debug)
+            except urllib2.URLError as err:
+                print('Session check failed:', err)
+                page = ''
+            if page.find('authenticatedArea/logout.eso') > 0:
+                print('Reusing ESO session:', sessionfile)
+                return opener
+            print('ESO session expired:', sessionfile)
+            cj.clear()
+
+    opener = login(verbose=verbose, debug=debug, pause=pause, cookiejar=cj)
+
+    # create the file readable by the owner only before the cookies
+    # are written to it
+    fd = os.open(sessionfile, os.O_WRONLY | os.O_CREAT, 0o600)
+    os.close(fd)
+    os.chmod(sessionfile, 0o600)
+    cj.save(ignore_discard=True)
+    if debug:
+        print('Saved ESO session:', sessionfile)
+
+    return opener
+
+
 def login_rgm():
     """
     deprecated 'rgm' version
@@ -263,292 +556,2268 @@ def login_rgm():
     return
 
 
-
-def plot_radec(ra, dec,
-               title=None, xlabel=None, ylabel=None,
-               rarange=None, decrange=None,
-               showplots=False, figfile=None):
+def load_validators(cachefile, debug=False):
     """
+    read the per-program cache of http validators
+
+    The cache is a json dict keyed by run e.g. 'A' with the ETag and
+    Last-Modified headers from the last full download of the run file
+    and the snapshot directory (outpath) that holds the matching csv
+    and FITS files.
 
     """
+    import os
+    import json
 
-    import matplotlib.pyplot as plt
+    if not os.path.exists(cachefile):
+        return {}
 
-    # plt.setp(lines, edgecolors='None')
-    if figfile is None:
-        figfile = 'radec.png'
+    try:
+        with open(cachefile, 'r') as fh:
+            validators = json.load(fh)
+    except ValueError as err:
+        print('Ignoring corrupt validator cache:', cachefile, err)
+        return {}
 
-    plt.figure(num=None, figsize=(9.0, 6.0))
+    if debug:
+        print('validators:', validators)
 
-    plt.xlabel('RA')
-    if xlabel is not None:
-        plt.xlabel(xlabel)
-    plt.ylabel('Dec')
-    if ylabel is not None:
-        plt.ylabel(ylabel)
-    if title is not None:
-        plt.title(title)
+    return validators
 
-    ms = 1.0
 
-    xdata = ra
-    ydata = dec
+def save_validators(cachefile, validators):
+    """
+    write the validator cache; via a unique temporary file and rename
+    so that an interrupted job does not leave a truncated cache behind
+    and concurrent writers do not write to the same temporary file
 
-    print(min(xdata), max(xdata))
-    print(min(ydata), max(ydata))
+    """
+    import os
+    import json
+    import tempfile
 
-    # plt.xlim([0,360])
-    # plt.ylim([-90,30])
+    fd, tmpfile = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(cachefile)),
+        prefix=os.path.basename(cachefile) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(validators, fh, indent=2, sort_keys=True)
+        os.chmod(tmpfile, 0644)
+        os.rename(tmpfile, cachefile)
+    except Exception:
+        os.remove(tmpfile)
+        raise
 
-    ms = 1.0
-    plt.plot(xdata, ydata, 'og', markeredgecolor='b', ms=ms)
-    # plotid.plotid()
 
-    if rarange is not None:
-        plt.xlim(rarange)
-    if decrange is not None:
-        plt.ylim(decrange)
+def update_validators(cachefile, updates):
+    """
+    add the entries in updates to the json dict in cachefile, keeping
+    the entries written by other processes since it was loaded e.g.
+    the build record, which is also updated by the plot stage (see
+    record_build). The cache is re-loaded and saved while holding an
+    exclusive lock on cachefile.lock.
 
-    ndata = len(xdata)
-    print('Number of data points plotted:', ndata)
-    plt.legend(['n: ' + str(ndata)],
-               fontsize='small',
-               loc='upper right',
-               numpoints=1, scatterpoints=1)
+    """
+    import fcntl
 
-    if showplots:
-        plt.show()
+    with open(cachefile + '.lock', 'a') as lockfh:
+        fcntl.flock(lockfh, fcntl.LOCK_EX)
+        try:
+            validators = load_validators(cachefile)
+            validators.update(updates)
+            save_validators(cachefile, validators)
+        finally:
+            fcntl.flock(lockfh, fcntl.LOCK_UN)
 
-    print('Saving:', figfile)
-    plt.savefig(figfile)
+    return validators
 
 
-def plot_raextime(xdata, ydata,
-                  title=None, xlabel=None, ylabel=None,
-                  rarange=None, decrange=None,
-                  showplots=False, figfile=None):
+def fetch_runfile(opener, url, outfile, validator=None,
+                  chunksize=65536, retries=4, debug=False):
     """
+    download a run file with a single http request
+
+    The headers and the body come from the same response and the body
+    is streamed to outfile in chunks; gzip content encoding is
+    requested and decoded on the fly. The file is written via a
+    temporary file so a failed request does not leave a partial csv.
+    Transient failures, including a dropped connection part way
+    through the body, are retried; see with_retries.
+
+    If validator is given the request is conditional on the ETag and
+    Last-Modified values it contains.
+
+    returns a dict with the http status, ETag, Last-Modified and the
+    number of bytes downloaded; status is 304 and nothing is written
+    if the run file has not been modified.
 
     """
+    import os
+    import zlib
 
-    import matplotlib.pyplot as plt
-    # plt.setp(lines, edgecolors='None')
+    request = urllib2.Request(url)
+    request.add_header('Accept-Encoding', 'gzip')
+    if validator is not None:
+        if validator.get('etag') is not None:
+            request.add_header('If-None-Match', validator['etag'])
+        if validator.get('last_modified') is not None:
+            request.add_header('If-Modified-Since',
+                               validator['last_modified'])
 
-    if figfile is None:
-        figfile = 'raextime.png'
+    def _fetch():
+        info = {'status': None, 'etag': None, 'last_modified': None,
+                'nbytes': 0}
 
-    plt.figure(num=None, figsize=(9.0, 6.0))
+        try:
+            response = opener.open(request)
+        except urllib2.HTTPError as err:
+            # hand the connection back to the pool
+            err.close()
+            if err.code != 304:
+                raise
+            info['status'] = 304
+            return info
+
+        httpheader = response.info()
+        if debug:
+            print('http header:', len(httpheader))
+            print(httpheader)
 
-    plt.xlabel('RA')
-    if xlabel is not None:
-        plt.xlabel(xlabel)
-    plt.ylabel('Execution Time(s)')
-    if ylabel is not None:
-        plt.ylabel(ylabel)
-    if title is not None:
-        plt.title(title)
+        info['status'] = response.getcode()
+        info['etag'] = httpheader.getheader('ETag')
+        info['last_modified'] = httpheader.getheader('Last-Modified')
 
-    ms = 1.0
+        decompressor = None
+        if httpheader.getheader('Content-Encoding') == 'gzip':
+            # 16 + MAX_WBITS tells zlib to expect the gzip header
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        tmpfile = outfile + '.tmp'
+        try:
+            with open(tmpfile, 'wb') as fh:
+                while True:
+                    chunk = response.read(chunksize)
+                    if not chunk:
+                        break
+                    info['nbytes'] += len(chunk)
+                    if decompressor is not None:
+                        chunk = decompressor.decompress(chunk)
+                    fh.write(chunk)
+                if decompressor is not None:
+                    fh.write(decompressor.flush())
+            response.close()
+            os.rename(tmpfile, outfile)
+        except Exception:
+            response.close()
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            raise
+
+        return info
+
+    return with_retries(_fetch, retries=retries, debug=debug)
+
+
+def reuse_snapshot(validator, runfile, fitsfile, outpath):
+    """
+    copy the csv and FITS files, and any other output formats of the
+    run e.g. parquet, for a run file that has not changed upstream from
+    the snapshot directory recorded in the validator into outpath.
 
-    print(min(xdata), max(xdata))
-    print(min(ydata), max(ydata))
+    returns True if both the csv and FITS files are available in outpath
 
-    # plt.xlim([0,360])
-    # plt.ylim([-90,30])
+    """
+    import os
+    import glob
 
-    ms = 1.0
-    plt.plot(xdata, ydata, 'og', markeredgecolor='b', ms=ms)
-    # plotid.plotid()
+    oldpath = validator.get('outpath')
+    if oldpath is None:
+        return False
 
-    if rarange is not None:
-        plt.xlim(rarange)
-    if decrange is not None:
-        plt.ylim(decrange)
+    for filename in [runfile, fitsfile]:
+        if not os.path.exists(os.path.join(oldpath, filename)):
+            return False
 
-    ndata = len(xdata)
-    print('Number of data points plotted:', ndata)
-    plt.legend(['n: ' + str(ndata)],
-               fontsize='small', loc='upper right',
-               numpoints=1, scatterpoints=1)
+    basename = os.path.splitext(runfile)[0]
+    filenames = [os.path.basename(src) for src in
+                 glob.glob(os.path.join(oldpath, basename + '.*'))
+                 if not src.endswith('.tmp')]
 
-    if showplots:
-        plt.show()
+    for filename in filenames:
+        src = os.path.join(oldpath, filename)
+        dest = os.path.join(outpath, filename)
+        if os.path.abspath(src) == os.path.abspath(dest):
+            continue
+        link_file(src, dest)
 
-    print('Saving:', figfile)
-    plt.savefig(figfile)
+    return True
 
 
-def getargs(verbose=False):
+def link_file(src, dest):
     """
+    replace dest with a hardlink to src or a copy if hardlinks are not
+    supported; the old snapshots are in the snapshot store so a
+    hardlink is safe
 
-    Template getargs function
+    """
+    import os
+    import shutil
 
-    Usage
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
 
-    python getargs.py --help
 
+def link_snapshot(oldpath, outpath, exclude=()):
+    """
+    link the files of the snapshot directory oldpath that are not in
+    outpath; files starting with a prefix in exclude are left out
 
-    def getargs():
+    returns the number of files linked
 
-    ....
+    """
+    import os
 
-    if __name__=='__main__':
+    nlinked = 0
+    for filename in sorted(os.listdir(oldpath)):
+        src = os.path.join(oldpath, filename)
+        dest = os.path.join(outpath, filename)
+        if filename == 'MANIFEST.json' or filename.endswith('.tmp') \
+                or filename.startswith(tuple(exclude)) \
+                or not os.path.isfile(src) or os.path.exists(dest):
+            continue
+        link_file(src, dest)
+        nlinked += 1
 
-        args = getargs()
-        debug = args.debug()
+    return nlinked
 
 
+def unchanged_snapshot(fetched, runs, validators):
+    """
+    find the snapshot that every run file was copied from unchanged
 
-    parse command line arguements
+    fetched is a dict of the fetch_runs info by run and runs the runs
+    that are expected. The validators record the snapshot each run
+    file was copied from.
 
-    not all args are active
+    returns the snapshot directory or None if a run was modified,
+    is missing or the runs were copied from different snapshots
 
     """
-    import sys
-    import pprint
-    import argparse
+    oldpaths = set()
+    for run in runs:
+        info = fetched.get(run)
+        if info is None or not info['notmodified']:
+            return None
+        oldpaths.add(validators.get(run, {}).get('outpath'))
 
-    # there is probably a version function out there
-    __version__ = '0.1'
+    if len(oldpaths) != 1:
+        return None
 
-    description = 'progresscsv command line arguements'
-    epilog = """WARNING: Not all options may be supported\n"""
+    return oldpaths.pop()
 
-    parser = argparse.ArgumentParser(
-        description=description, epilog=epilog,
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-    # the destination defaults to the option parameter
-    # defaul=False might not be needed
+def file_hash(filename, chunksize=1 << 20):
+    """
+    sha256 hex digest of the contents of a file
 
-    # default type is string
-    parser.add_argument("--string",
-                        help="string input")
+    """
+    import hashlib
 
-    parser.add_argument("--float", type=float,
-                        help="float input")
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        while True:
+            chunk = fh.read(chunksize)
+            if not chunk:
+                break
+            sha.update(chunk)
 
-    parser.add_argument("--infile",
-                        help="Input file name")
+    return sha.hexdigest()
 
-    parser.add_argument("--configfile",
-                        default=None,
-                        help="configuration file")
 
-    parser.add_argument("--stats",
-                        action='store_true',
-                        help="Compute stats")
+def build_digest(inputs):
+    """
+    sha256 hex digest of the input hashes of a derived product and
+    SCHEMA_VERSION so that a schema change rebuilds everything
 
+    """
+    import hashlib
 
-    parser.add_argument("--debug",
-                        action='store_true',
-                        help="debug option")
+    sha = hashlib.sha256('schema %d\n' % SCHEMA_VERSION)
+    for digest in inputs:
+        sha.update(digest + '\n')
 
-    parser.add_argument("--pause",
-                        action='store_true',
-                        help="pause option")
+    return sha.hexdigest()
 
-    parser.add_argument("--verbose", default=verbose,
-                        action='store_true',
-                        help="verbose option")
 
-    parser.add_argument("--version", action='store_true',
-                        help="verbose option")
+def record_build(buildfile, product, digest, outpath):
+    """
+    add a product made from the inputs digest in outpath to the build
+    record in buildfile; used by the plot stage, see build_uptodate
 
-    args = parser.parse_args()
+    """
+    update_validators(buildfile,
+                      {product: {'inputs': digest, 'outpath': outpath}})
 
-    if args.debug or args.verbose:
-        print()
-        print('Number of arguments:', len(sys.argv),
-              'arguments: ', sys.argv[0])
 
-    if args.debug or args.verbose:
-        print()
-        for arg in vars(args):
-            print(arg, getattr(args, arg))
-        print()
+def build_uptodate(build, product, digest, outpath):
+    """
+    check a derived product against the build record
 
-    if args.debug or args.verbose:
-        print()
-        pprint.pprint(args)
-        print()
+    The build record is a json dict keyed by product filename, in the
+    same format as the validators, with the build_digest of the inputs
+    the product was made from and the snapshot directory (outpath)
+    that holds it. The build graph of a program is:
 
-    if args.version:
-        print('version:', __version__)
-        sys.exit(0)
+    PROGRAM<run>.fits and columnar copies: from PROGRAM<run>.csv
+    PROGRAM.fits, PROGRAM.csv and columnar copies: from the run files
+    PROGRAM_stats.fits and .csv: from the summary
+    progress_*.png: from the summary; a glob as there is a figure per
+    run and OB status (see plot_jobs). Recorded by the plot stage when
+    all the figures have been made (see start_plots)
 
-    return args
+    A product made from the same inputs in another snapshot is linked
+    into outpath.
 
+    returns True if the product is up to date in outpath
 
-def getconfig(configfile=None, debug=False, silent=False):
     """
-    read config file
+    import os
+    import glob
 
-    Note the Python 2 ConfigParser module has been renamed to configparser
-    in Python 3 so it better to use import configparser in Python 2 for
-    future proofing
+    entry = build.get(product)
+    if entry is None or entry.get('inputs') != digest or \
+            entry.get('outpath') is None:
+        return False
 
-    see also getconfig.cfg
+    filenames = [os.path.basename(src) for src in
+                 glob.glob(os.path.join(entry['outpath'], product))
+                 if not src.endswith('.tmp')]
+    if len(filenames) == 0:
+        return False
 
-    TODO: catch exceptions
+    for filename in filenames:
+        src = os.path.join(entry['outpath'], filename)
+        dest = os.path.join(outpath, filename)
+        if not os.path.exists(dest) or not os.path.samefile(src, dest):
+            link_file(src, dest)
 
-    Support for lists:
+    return True
 
-    see:
 
-    https://stackoverflow.com/questions/335695/lists-in-configparser
+def store_snapshot(outpath_root, outpath, debug=False):
+    """
+    deduplicate a snapshot directory into the content addressed object
+    store OUTPATH_ROOT/objects
 
-    https://github.com/cacois/python-configparser-examples
+    Each file in outpath is stored once under objects/ab/abcdef... keyed
+    by the sha256 of its contents and the file in outpath is replaced by
+    a hardlink to the object, so files that do not change from day to
+    day e.g. the csv and FITS files of old runs take up the disk space
+    of a single copy. Readers of outpath (and current/) see ordinary
+    files. A MANIFEST.json listing the hash, size, mtime and inode of
+    every file is written into outpath.
 
-    look in cwd, home and home/.config
+    A file that is the same inode, size and mtime as in the manifest of
+    outpath or of the previous snapshot is already in the store (e.g.
+    linked from the previous snapshot) and is not hashed again, so
+    storing a snapshot in which little has changed is cheap.
 
-    home/.config not implemented yet
+    Files in the snapshot must only ever be replaced (write to a
+    temporary file and rename) and not rewritten in place, since that
+    would change the object shared with other snapshots.
 
+    returns the manifest dict
 
     """
     import os
-    import configparser
+    import json
+
+    objects = os.path.join(outpath_root, 'objects')
+
+    # the stored files by inode from this and the previous manifest
+    stored = {}
+    manifestfiles = [previous_snapshot(outpath_root,
+                                       os.path.basename(outpath),
+                                       'MANIFEST.json'),
+                     os.path.join(outpath, 'MANIFEST.json')]
+    for manifestfile in manifestfiles:
+        if manifestfile is None or not os.path.exists(manifestfile):
+            continue
+        try:
+            with open(manifestfile) as fh:
+                entries = json.load(fh)
+        except ValueError as err:
+            print('Cannot read:', manifestfile, err)
+            continue
+        for entry in entries.values():
+            if 'ino' in entry:
+                stored[(entry['dev'], entry['ino'])] = entry
+
+    manifest = {}
+    nstored = 0
+    nlinked = 0
+    nhashed = 0
+    for filename in sorted(os.listdir(outpath)):
+        path = os.path.join(outpath, filename)
+        if filename == 'MANIFEST.json' or filename.endswith('.tmp') \
+                or os.path.islink(path) or not os.path.isfile(path):
+            continue
+
+        stat = os.stat(path)
+        entry = stored.get((stat.st_dev, stat.st_ino), {})
+        digest = entry.get('sha256')
+        if entry.get('size') != stat.st_size or \
+                entry.get('mtime') != stat.st_mtime or \
+                not os.path.exists(os.path.join(objects, digest[:2],
+                                                digest)):
+            digest = file_hash(path)
+            nhashed += 1
+
+        objdir = os.path.join(objects, digest[:2])
+        objfile = os.path.join(objdir, digest)
+        if not os.path.isdir(objdir):
+            os.makedirs(objdir)
 
-    # read the configuration file
-    # config = configparser.RawConfigParser()
-    config = configparser.SafeConfigParser()
+        try:
+            if not os.path.exists(objfile):
+                os.link(path, objfile)
+                nstored += 1
+            elif not os.path.samefile(path, objfile):
+                tmpfile = path + '.tmp'
+                os.link(objfile, tmpfile)
+                os.rename(tmpfile, path)
+                nlinked += 1
+        except OSError as err:
+            # e.g. a filesystem without hardlinks; keep the file as is
+            print('Cannot add to snapshot store:', path, err)
+
+        # the file may have been replaced by a link to the object
+        stat = os.stat(path)
+        manifest[filename] = {'sha256': digest, 'size': stat.st_size,
+                              'mtime': stat.st_mtime, 'dev': stat.st_dev,
+                              'ino': stat.st_ino}
+
+    manifestfile = os.path.join(outpath, 'MANIFEST.json')
+    with open(manifestfile + '.tmp', 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.rename(manifestfile + '.tmp', manifestfile)
+
+    print('Snapshot store:', objects, 'new objects:', nstored,
+          'deduplicated files:', nlinked, 'files hashed:', nhashed)
+
+    return manifest
+
+
+def fetch_run(opener, progid, run, outpath, validator=None, debug=False):
+    """
+    fetch one run file into outpath
 
-    print('__file__', __file__)
-    if configfile is None:
-        if debug:
-            print('__file__', __file__)
-        configfile_default = os.path.splitext(__file__)[0] + '.cfg'
-    if configfile is not None:
-        configfile_default = configfile
+    An unchanged run file (http 304) is reused from the snapshot
+    recorded in the validator; if that snapshot has gone the run file
+    is downloaded in full.
 
-    print('Open configfile:', configfile)
-    if debug:
-        print('Open configfile:', configfile)
+    returns the fetch_runfile info dict with an extra 'notmodified' key
 
-    try:
-        if not silent:
-            print('Reading config file', configfile)
+    """
+    import os
 
-        try:
-            config.read(configfile)
-        except IOError:
-            print('config file', configfile, "does not exist")
-            configfile = os.path.join(os.environ["HOME"], configfile)
-            print('trying ', configfile)
-            config.read(configfile)
+    runfile = progid + '%s.csv' % run
+    fitsfile = progid + '%s.fits' % run
+    urlcsv = CSV_URL + runfile
+    print('Reading: ', urlcsv)
 
-    except Exception as e:
-        print('Problem reading config file: ', configfile)
-        print(e)
+    if validator is None:
+        validator = {}
 
-    if debug:
-        print('configfile:', configfile)
-        print('sections:', config.sections())
-        for section_name in config.sections():
-            print('Section:', section_name)
-            print('Options:', config.options(section_name))
-            for name, value in config.items(section_name):
-                print('  %s = %s' % (name, value))
+    ResultFile = os.path.join(outpath, runfile)
+    info = fetch_runfile(opener, urlcsv, ResultFile,
+                         validator=validator, debug=debug)
+    info['notmodified'] = False
+    if info['status'] == 304:
+        info['notmodified'] = reuse_snapshot(validator, runfile,
+                                             fitsfile, outpath)
+        if not info['notmodified']:
+            # snapshot has gone; download in full
+            print('Previous snapshot missing:', validator)
+            info = fetch_runfile(opener, urlcsv, ResultFile, debug=debug)
+            info['notmodified'] = False
+
+    return info
+
+
+def fetch_runs(opener, progid, runs, outpath, validators=None,
+               closed=(), stop_on_missing=True, nworkers=8, debug=False):
+    """
+    fetch the run files concurrently with a pool of nworkers threads
+    that share the authenticated opener (and so the cookie jar)
+
+    Runs are fetched in windows of nworkers and fetching stops at the
+    first run in sequence that does not exist (http 404), which is the
+    end of the run sequence; unless stop_on_missing is False when the
+    run is just left out. A run that still fails after the retries
+    in fetch_runfile does not truncate the sequence; the copy from the
+    previous snapshot is used if there is one, otherwise the run is
+    left out with an error message.
+
+    The runs in closed (see discover_runs) are taken from the previous
+    snapshot without a request if it is available.
+
+    returns a list of (run, info) tuples in run order and the list of
+    runs that do not exist (see update_runindex)
+
+    """
+    import sys
+    from multiprocessing.pool import ThreadPool
+
+    if validators is None:
+        validators = {}
+
+    def _fetch(run):
+        validator = validators.get(run, {})
+        if run in closed and reuse_snapshot(
+                validator, progid + '%s.csv' % run,
+                progid + '%s.fits' % run, outpath):
+            print('Closed run:', run, 'from', validator['outpath'])
+            return {'status': None, 'nbytes': 0,
+                    'etag': validator.get('etag'),
+                    'last_modified': validator.get('last_modified'),
+                    'notmodified': True}
+        try:
+            return fetch_run(opener, progid, run, outpath,
+                             validator=validators.get(run), debug=debug)
+        except Exception as err:
+            return err
+
+    nworkers = max(1, nworkers)
+    pool = ThreadPool(nworkers)
+    fetched = []
+    missing = []
+    try:
+        for i in range(0, len(runs), nworkers):
+            window = list(runs[i:i + nworkers])
+            # map returns the results in the order of window
+            results = pool.map(_fetch, window)
+            for run, info in zip(window, results):
+                runfile = progid + '%s.csv' % run
+                if isinstance(info, urllib2.HTTPError) and info.code == 404:
+                    print('Run file does not exist:', runfile)
+                    missing.append(run)
+                    if not stop_on_missing:
+                        continue
+                    print('End of the run sequence')
+                    print()
+                    return fetched, missing
+                if isinstance(info, Exception):
+                    sys.stderr.write('ERROR: %s\n' % str(info))
+                    print('Problem reading:', runfile)
+                    validator = validators.get(run, {})
+                    if reuse_snapshot(validator, runfile,
+                                      progid + '%s.fits' % run, outpath):
+                        print('Using previous snapshot:',
+                              validator['outpath'])
+                        info = {'status': None, 'nbytes': 0,
+                                'etag': validator.get('etag'),
+                                'last_modified':
+                                    validator.get('last_modified'),
+                                'notmodified': True}
+                    else:
+                        print('Leaving out run:', run)
+                        continue
+                fetched.append((run, info))
+    finally:
+        pool.close()
+        pool.join()
+
+    return fetched, missing
+
+
+def run_ids(n):
+    """
+    the first n run IDs in order; A to Z then AA, AB etc
+
+    """
+    import string
+
+    ids = []
+    for length in range(1, 3):
+        for i in range(26 ** length):
+            run = ''
+            for j in range(length):
+                run = string.ascii_uppercase[i % 26] + run
+                i //= 26
+            ids.append(run)
+            if len(ids) == n:
+                return ids
+
+    return ids
+
+
+def run_order(run):
+    """
+    sort key for run IDs so that Z comes before AA
+
+    """
+    return (len(run), run)
+
+
+def probe_run(opener, url, debug=False):
+    """
+    check whether a run file exists with a HEAD request, or a ranged
+    GET of the first byte if the HEAD request fails e.g. the server
+    does not support HEAD (http 405)
+
+    returns True or False, or None if it could not be determined
+
+    """
+    request = urllib2.Request(url)
+    request.get_method = lambda: 'HEAD'
+
+    try:
+        response = with_retries(lambda: opener.open(request), debug=debug)
+        response.close()
+        return True
+    except urllib2.HTTPError as err:
+        err.close()
+        if err.code == 404:
+            return False
+    except Exception as err:
+        print('Cannot probe with HEAD:', url, err)
+
+    request = urllib2.Request(url)
+    request.add_header('Range', 'bytes=0-0')
+    try:
+        response = with_retries(lambda: opener.open(request), debug=debug)
+        response.close()
+        return True
+    except urllib2.HTTPError as err:
+        err.close()
+        if err.code == 404:
+            return False
+        # range not satisfiable; an empty file
+        if err.code == 416:
+            return True
+        return None
+    except Exception as err:
+        print('Cannot probe:', url, err)
+        return None
+
+
+def check_run(opener, url, validator=None, debug=False):
+    """
+    check whether a run file has changed since the download recorded
+    in validator with a conditional HEAD request so nothing is
+    downloaded
+
+    returns True if the run file has changed, False if not, 'missing'
+    if it no longer exists (http 404) or None if it could not be
+    determined
+
+    """
+    if validator is None:
+        validator = {}
+
+    request = urllib2.Request(url)
+    request.get_method = lambda: 'HEAD'
+    if validator.get('etag') is not None:
+        request.add_header('If-None-Match', validator['etag'])
+    if validator.get('last_modified') is not None:
+        request.add_header('If-Modified-Since', validator['last_modified'])
+
+    try:
+        response = with_retries(lambda: opener.open(request), debug=debug)
+        httpheader = response.info()
+        response.close()
+    except urllib2.HTTPError as err:
+        err.close()
+        if err.code == 304:
+            return False
+        if err.code == 404:
+            return 'missing'
+        return None
+    except Exception as err:
+        print('Cannot check:', url, err)
+        return None
+
+    # servers that ignore the conditional headers
+    etag = httpheader.getheader('ETag')
+    if etag is not None:
+        return etag != validator.get('etag')
+    last_modified = httpheader.getheader('Last-Modified')
+    if last_modified is not None:
+        return last_modified != validator.get('last_modified')
+
+    return True
+
+
+def discover_runs(opener, progid, runindex, nworkers=8, maxgap=3,
+                  validators=None, recheck_days=7.0, debug=False):
+    """
+    find the runs of a program using the cached run index
+
+    The run index is a dict keyed by run with a 'status' of 'live',
+    'closed' or 'missing' (see update_runindex). Runs that are already
+    known are not probed. Candidate runs that are not known (gaps and
+    the runs after the last known run) are probed concurrently (see
+    probe_run) until maxgap consecutive candidates after the last run
+    found do not exist, so gaps in the run sequence and more than 26
+    runs are handled. A run whose probe fails is neither recorded nor
+    extends the scan; it is returned as live so the fetch stage tries
+    it and it is probed again next time.
+
+    Closed runs are not requested by fetch_runs but the results of
+    OBs carried over to a later period can still be added to an old
+    run file, so a closed run that has not been checked for
+    recheck_days is checked with a conditional HEAD request using the
+    validators (see check_run) and is reopened if it has changed or
+    marked missing if it has gone.
+
+    returns the lists of live and closed runs in run order; runindex is
+    updated
+
+    """
+    import time
+    from multiprocessing.pool import ThreadPool
+
+    if validators is None:
+        validators = {}
+
+    candidates = run_ids(26 * 27)
+
+    present = set([run for run, entry in runindex.items()
+                   if entry.get('status') in ('live', 'closed')])
+    last = -1
+    for run in present:
+        if run in candidates:
+            last = max(last, candidates.index(run))
+
+    def _probe(run):
+        url = CSV_URL + progid + '%s.csv' % run
+        return probe_run(opener, url, debug=debug)
+
+    def _check(run):
+        url = CSV_URL + progid + '%s.csv' % run
+        validator = dict(runindex[run])
+        validator.update(validators.get(run, {}))
+        return check_run(opener, url, validator=validator, debug=debug)
+
+    limit = last + 1 + maxgap
+    i = 0
+    nprobed = 0
+    unknown = []
+    pool = ThreadPool(max(1, nworkers))
+    try:
+        while i < min(limit, len(candidates)):
+            span = candidates[i:min(limit, i + nworkers)]
+            i += len(span)
+            window = [run for run in span if run not in present]
+            nprobed += len(window)
+            for run, exists in zip(window, pool.map(_probe, window)):
+                if exists is False:
+                    runindex[run] = {'status': 'missing'}
+                    continue
+                if exists is None:
+                    unknown.append(run)
+                    continue
+                present.add(run)
+                runindex.setdefault(run, {})['status'] = 'live'
+                limit = max(limit, candidates.index(run) + 1 + maxgap)
+
+        now = time.time()
+        recheck = [run for run in present
+                   if runindex[run]['status'] == 'closed' and
+                   now - runindex[run].get('checked', 0) >
+                   recheck_days * 86400.0]
+        for run, changed in zip(recheck, pool.map(_check, recheck)):
+            if changed is None:
+                continue
+            runindex[run]['checked'] = now
+            if changed == 'missing':
+                print('Closed run no longer exists:', run)
+                runindex[run] = {'status': 'missing'}
+                present.discard(run)
+            elif changed:
+                print('Closed run has changed:', run)
+                runindex[run]['status'] = 'live'
+    finally:
+        pool.close()
+        pool.join()
+
+    live = sorted([run for run in present
+                   if runindex[run]['status'] == 'live'] + unknown,
+                  key=run_order)
+    closed = sorted([run for run in present
+                     if runindex[run]['status'] == 'closed'], key=run_order)
+    print('Run discovery: probed', nprobed, 'live runs:', ''.join(live),
+          'closed runs:', ''.join(closed), 'unknown:', ''.join(unknown),
+          'closed runs checked:', len(recheck))
+
+    return live, closed
+
+
+def update_runindex(runindex, fetched, missing=(), closed_days=365):
+    """
+    update the run index from the fetched runs; a run whose file has not
+    been modified for closed_days is marked closed so that it is only
+    checked now and then (see discover_runs) and not requested by
+    fetch_runs. The time of the last request for a run is kept as
+    'checked'. The runs in missing no longer exist and are marked
+    missing so they are probed again by discover_runs.
+
+    """
+    import time
+    from email.utils import parsedate_tz, mktime_tz
+
+    for run, info in fetched:
+        entry = runindex.setdefault(run, {})
+        entry['status'] = 'live'
+        entry['last_modified'] = info.get('last_modified')
+        if info.get('status') is not None:
+            entry['checked'] = time.time()
+        if info.get('last_modified') is None:
+            continue
+        modified = parsedate_tz(info['last_modified'])
+        if modified is None:
+            continue
+        age = (time.time() - mktime_tz(modified)) / 86400.0
+        if age > closed_days:
+            entry['status'] = 'closed'
+
+    for run in missing:
+        runindex[run] = {'status': 'missing'}
+
+
+def open_summary(filename):
+    """
+    open the summary csv of all the run files for writing
+
+    The summary is written to a temporary file that is renamed by
+    close_summary so readers never see a partial summary.
+
+    """
+    return open(filename + '.tmp', 'w')
+
+
+def append_summary(fh, lines, nskip=2):
+    """
+    append the lines of a run file to the open summary csv
+
+    The preamble and header lines (nskip) are only written for the first
+    run file so each data row is written exactly once.
+
+    returns the number of data rows appended
+
+    """
+    if fh.tell() == 0:
+        fh.writelines(lines)
+    else:
+        fh.writelines(lines[nskip:])
+
+    return max(0, len(lines) - nskip)
+
+
+def close_summary(fh, filename):
+    """
+    close the summary csv and move it into place
+
+    """
+    import os
+
+    fh.close()
+    os.rename(fh.name, filename)
+
+
+def _read_csv_fast(infile, iheader, colnames, dtypes):
+    """
+    parse a progress csv with the astropy C reader (no format guessing)
+    and cast the columns to the schema dtypes
+
+    returns the list of columns, or None if the file could not be
+    parsed or a column was not read as the schema expects e.g. a
+    number in a string column or a fraction in an integer column
+
+    """
+    import numpy as np
+    from astropy.io import ascii
+    from astropy.table import MaskedColumn
+
+    # the basic format rather than csv, which pads short rows
+    try:
+        table = ascii.read(infile, format='basic', delimiter=',',
+                           comment=None, guess=False, fast_reader='force',
+                           header_start=iheader, data_start=iheader + 1)
+    except Exception:
+        return None
+    if table.colnames != colnames:
+        return None
+
+    columns = []
+    for colname in colnames:
+        dtype = dtypes.get(colname, 'S')
+        column = table[colname]
+        mask = np.ma.getmaskarray(column)
+        data = np.ma.getdata(column)
+        if dtype == 'S' or dtype.startswith('M8'):
+            if data.dtype.kind != 'S':
+                return None
+            data = data.copy()
+            data[mask] = ''
+            if dtype == 'S':
+                columns.append(data)
+                continue
+            try:
+                # empty strings are parsed as NaT
+                columns.append(data.astype(dtype))
+            except ValueError:
+                return None
+            continue
+
+        if data.dtype.kind not in 'iuf' or \
+                (data.dtype.kind == 'f' and np.dtype(dtype).kind != 'f'):
+            return None
+        data = data.astype(dtype)
+        if mask.any():
+            columns.append(MaskedColumn(data, mask=mask))
+        else:
+            columns.append(data)
+
+    return columns
+
+
+def read_progress_csv(infile, schema=None, debug=False):
+    """
+    read an ESO progress csv file into a table using the column schema
+
+    infile is a filename or a list of lines. The astropy C reader splits
+    the rows and each column is cast in one go to the numpy dtype given
+    in the schema (default PROGRESS_SCHEMA) so there is no format
+    guessing; 'Status date' becomes datetime64. The preamble line that
+    ESO adds before the header is skipped. If a column is not read as
+    the schema expects (see _read_csv_fast) the file is parsed again
+    with the csv module and each column converted from the strings.
+
+    Schema drift is reported loudly: columns missing from the file or
+    not in the schema give a warning (unknown columns are read as
+    strings) and a value that does not convert raises ValueError with
+    the column name and line number.
+
+    Empty values are masked in numeric columns and NaT in date columns.
+
+    """
+    import csv
+    import warnings
+    import numpy as np
+    from astropy.table import Table, MaskedColumn
+
+    if schema is None:
+        schema = PROGRESS_SCHEMA
+    dtypes = dict(schema)
+
+    if isinstance(infile, list):
+        head = infile[:2]
+    else:
+        with open(infile, 'r') as fh:
+            head = [fh.readline(), fh.readline()]
+
+    # the header is the first line with a schema column name in it
+    iheader = None
+    for i, row in enumerate(csv.reader(head)):
+        if len(set([c.strip() for c in row]) & set(dtypes)) > 0:
+            iheader = i
+            break
+    if iheader is None:
+        raise ValueError('No progress csv header found in the first ' +
+                         'two lines of ' + str(infile)[:80])
+
+    colnames = [c.strip() for c in list(csv.reader(head))[iheader]]
+    data_start = iheader + 1
+
+    missing = [name for name, dtype in schema if name not in colnames]
+    unknown = [name for name in colnames if name not in dtypes]
+    if missing:
+        warnings.warn('Schema drift: columns missing from progress csv: ' +
+                      ', '.join(missing))
+    if unknown:
+        warnings.warn('Schema drift: columns not in the schema: ' +
+                      ', '.join(unknown))
+
+    data_columns = _read_csv_fast(infile, iheader, colnames, dtypes)
+    if data_columns is not None:
+        table = Table(data_columns, names=colnames)
+        if debug:
+            print('read_progress_csv:', len(table), 'rows', table.dtype)
+        return table
+
+    if isinstance(infile, list):
+        lines = infile
+    else:
+        with open(infile, 'r') as fh:
+            lines = fh.readlines()
+
+    rows = list(csv.reader(lines))
+    rows = [row for row in rows[data_start:] if len(row) > 0]
+
+    for i, row in enumerate(rows):
+        if len(row) != len(colnames):
+            raise ValueError('Line %d has %d columns; expected %d' %
+                             (data_start + i + 1, len(row), len(colnames)))
+
+    columns = zip(*rows) if rows else [()] * len(colnames)
+
+    data_columns = []
+    for colname, values in zip(colnames, columns):
+        dtype = dtypes.get(colname, 'S')
+        # csv files written by older versions of this script have a
+        # space at the start of every line after the first
+        values = np.char.strip(np.array(values, dtype='S'))
+        if dtype == 'S':
+            data_columns.append(values)
+            continue
+
+        empty = values == ''
+        try:
+            if dtype.startswith('M8'):
+                # empty strings are parsed as NaT
+                data_columns.append(values.astype(dtype))
+                continue
+            values[empty] = '0'
+            data = values.astype(dtype)
+        except ValueError as err:
+            # find the bad value for the error message
+            for i, value in enumerate(values):
+                try:
+                    np.array([value]).astype(dtype)
+                except ValueError:
+                    break
+            raise ValueError('Column %r line %d: cannot convert %r to %s' %
+                             (colname, data_start + i + 1, value, dtype))
+
+        if empty.any():
+            data_columns.append(MaskedColumn(data, mask=empty))
+        else:
+            data_columns.append(data)
+
+    table = Table(data_columns, names=colnames)
+
+    if debug:
+        print('read_progress_csv:', len(table), 'rows', table.dtype)
+
+    return table
+
+
+def load_cached_table(cachedir, key):
+    """
+    read a table saved by save_cached_table; a hit marks the entry as
+    recently used for the LRU eviction
+
+    returns the table or None if key is not in the cache
+
+    """
+    import os
+    import numpy as np
+    from astropy.table import Table, MaskedColumn
+
+    datafile = os.path.join(cachedir, key + '.npy')
+    maskfile = os.path.join(cachedir, key + '_mask.npy')
+    try:
+        data = np.load(datafile, allow_pickle=False)
+        mask = None
+        if os.path.exists(maskfile):
+            mask = np.load(maskfile, allow_pickle=False)
+            os.utime(maskfile, None)
+        os.utime(datafile, None)
+    except (IOError, OSError, ValueError):
+        # a miss, or an entry being evicted by another process
+        return None
+
+    columns = []
+    for colname in data.dtype.names:
+        if mask is not None and mask[colname].any():
+            columns.append(MaskedColumn(data[colname], mask=mask[colname]))
+        else:
+            columns.append(data[colname])
+
+    return Table(columns, names=data.dtype.names)
+
+
+def save_cached_table(cachedir, key, table, maxbytes=1 << 30):
+    """
+    save a table read by read_progress_csv in the parsed table cache
+
+    The cache holds the typed tables as numpy .npy files named by key,
+    with the mask of the masked columns in a second file, which load
+    without any text parsing. Entries are written via a temporary file
+    and rename. The least recently used entries are removed when the
+    cache is larger than maxbytes; see evict_cache.
+
+    """
+    import os
+    import numpy as np
+
+    if not os.path.isdir(cachedir):
+        try:
+            os.makedirs(cachedir)
+        except OSError:
+            # made by another process
+            pass
+
+    data = table.as_array()
+    arrays = [(key + '.npy', np.ma.getdata(data))]
+    if table.masked or [colname for colname in table.colnames
+                        if hasattr(table[colname], 'mask')]:
+        mask = np.ma.getmaskarray(np.ma.asarray(data))
+        arrays.append((key + '_mask.npy', mask))
+
+    # the mask first so that a data file always has its mask
+    for filename, array in reversed(arrays):
+        filename = os.path.join(cachedir, filename)
+        with open(filename + '.tmp', 'wb') as fh:
+            np.save(fh, array, allow_pickle=False)
+        os.rename(filename + '.tmp', filename)
+
+    evict_cache(cachedir, maxbytes)
+
+
+def evict_cache(cachedir, maxbytes):
+    """
+    remove the least recently used entries of the parsed table cache
+    until it is no larger than maxbytes
+
+    returns the number of entries removed
+
+    """
+    import os
+
+    entries = {}
+    for filename in os.listdir(cachedir):
+        if not filename.endswith('.npy'):
+            continue
+        path = os.path.join(cachedir, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        key = filename.split('.')[0].split('_')[0]
+        size, mtime = entries.get(key, (0, 0))
+        entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+
+    total = sum(size for size, mtime in entries.values())
+    nremoved = 0
+    for key in sorted(entries, key=lambda key: entries[key][1]):
+        if total <= maxbytes:
+            break
+        for filename in [key + '.npy', key + '_mask.npy']:
+            try:
+                os.remove(os.path.join(cachedir, filename))
+            except OSError:
+                pass
+        total -= entries[key][0]
+        nremoved += 1
+
+    return nremoved
+
+
+def read_progress_cached(infile, cachedir, maxbytes=1 << 30, key=None,
+                         debug=False):
+    """
+    read_progress_csv through the parsed table cache in cachedir
+
+    The cache key is the build_digest of the sha256 of the csv file,
+    which includes SCHEMA_VERSION, so an entry is only used for a file
+    with the same contents parsed with the same schema. key may be
+    given if the digest is already known. A maxbytes of 0 disables the
+    cache.
+
+    """
+    if maxbytes <= 0:
+        return read_progress_csv(infile, debug=debug)
+
+    if key is None:
+        key = build_digest([file_hash(infile)])
+
+    table = load_cached_table(cachedir, key)
+    if table is not None:
+        if debug:
+            print('Parsed table cache hit:', infile, key)
+        return table
+
+    table = read_progress_csv(infile, debug=debug)
+    save_cached_table(cachedir, key, table, maxbytes=maxbytes)
+
+    return table
+
+
+def write_table(table, filename, format='fits'):
+    """
+    write a table read by read_progress_csv e.g. to FITS
+
+    FITS has no datetime64 type so date columns are written as ISO
+    strings. The table is written via a temporary file and renamed so
+    an existing file, which may be hardlinked into the snapshot store,
+    is replaced rather than overwritten; see store_snapshot.
+
+    """
+    import os
+    import numpy as np
+
+    table = table.copy(copy_data=False)
+    for colname in table.colnames:
+        if table[colname].dtype.kind == 'M':
+            values = np.datetime_as_string(table[colname])
+            width = 1
+            if len(values) > 0:
+                width = max(width, np.char.str_len(values).max())
+            table[colname] = values.astype('S%d' % width)
+
+    tmpfile = filename + '.tmp'
+    table.write(tmpfile, format=format, overwrite=True)
+    os.rename(tmpfile, filename)
+
+
+# columnar output formats and their file extensions; see write_columnar
+COLUMNAR_FORMATS = {'parquet': '.parquet',
+                    'arrow': '.arrow',
+                    'hdf5': '.hdf5'}
+
+# suffix of the mask columns in hdf5 files
+HDF5_MASK = ' mask'
+
+
+def _to_arrow(table):
+    """
+    convert an astropy table to a pyarrow table; strings are decoded to
+    utf8 and masked values become nulls
+
+    """
+    import numpy as np
+    import pyarrow as pa
+
+    arrays = []
+    for colname in table.colnames:
+        column = table[colname]
+        data = np.asarray(column)
+        if not data.dtype.isnative:
+            # e.g. big endian columns read from FITS
+            data = data.astype(data.dtype.newbyteorder('='))
+        if data.dtype.kind == 'S':
+            data = np.char.decode(data, 'utf-8')
+        mask = getattr(column, 'mask', None)
+        if mask is not None and np.any(mask):
+            arrays.append(pa.array(data, mask=np.asarray(mask)))
+        else:
+            arrays.append(pa.array(data))
+
+    return pa.Table.from_arrays(arrays, names=list(table.colnames))
+
+
+def _arrow_mask(chunk):
+    """
+    the null mask of a pyarrow array from its validity bitmap
+
+    """
+    import numpy as np
+
+    if chunk.null_count == 0:
+        return np.zeros(len(chunk), dtype=bool)
+
+    bits = np.unpackbits(np.frombuffer(chunk.buffers()[0], dtype='u1'))
+    # arrow bitmaps are least significant bit first
+    valid = bits.reshape(-1, 8)[:, ::-1].ravel()
+
+    return valid[chunk.offset:chunk.offset + len(chunk)] == 0
+
+
+def _arrow_data(chunk):
+    """
+    the values of a pyarrow array from its data buffers without
+    converting to python objects; utf8 strings become the 'S' dtype
+    with the same bytes. The values under nulls are undefined.
+
+    returns a numpy array or None for other types
+
+    """
+    import numpy as np
+    import pyarrow as pa
+
+    atype = chunk.type
+    nrows = len(chunk)
+    offset = chunk.offset
+    buffers = chunk.buffers()
+
+    if pa.types.is_string(atype) or pa.types.is_binary(atype):
+        offsets = np.frombuffer(buffers[1], dtype='i4')[offset:
+                                                        offset + nrows + 1]
+        data = np.zeros(0, dtype='u1')
+        if buffers[2] is not None:
+            data = np.frombuffer(buffers[2], dtype='u1')
+        lengths = np.diff(offsets)
+        width = max(1, lengths.max() if nrows > 0 else 1)
+        # the bytes of each value are the first length bytes of a row
+        # of a 2D array, in row major order
+        values = np.zeros((nrows, width), dtype='u1')
+        values[np.arange(width) < lengths[:, None]] = \
+            data[offsets[0]:offsets[-1]]
+        return values.view('S%d' % width).ravel()
+
+    if pa.types.is_timestamp(atype):
+        dtype = 'M8[%s]' % atype.unit
+    elif pa.types.is_integer(atype) or pa.types.is_floating(atype):
+        dtype = atype.to_pandas_dtype()
+    else:
+        return None
+
+    return np.frombuffer(buffers[1], dtype=dtype)[offset:offset + nrows]
+
+
+def _from_arrow(atable):
+    """
+    convert a pyarrow table to an astropy table; nulls become masked
+    values and strings are encoded back to the 'S' dtype
+
+    The values and masks are taken from the arrow buffers (see
+    _arrow_data and _arrow_mask) rather than via python lists.
+
+    """
+    import numpy as np
+    from astropy.table import Table, MaskedColumn
+
+    columns = []
+    for name in atable.column_names:
+        column = atable.column(name)
+        chunks = [_arrow_data(chunk) for chunk in column.chunks]
+        if chunks and not [chunk for chunk in chunks if chunk is None]:
+            if len(set(chunk.dtype.itemsize for chunk in chunks)) > 1:
+                # strings of different widths
+                width = max(chunk.dtype.itemsize for chunk in chunks)
+                chunks = [chunk.astype('S%d' % width) for chunk in chunks]
+            data = np.concatenate(chunks)
+            mask = None
+            if column.null_count > 0:
+                mask = np.concatenate([_arrow_mask(chunk)
+                                       for chunk in column.chunks])
+        elif column.null_count > 0:
+            values = column.to_pylist()
+            mask = np.array([value is None for value in values])
+            fill = [value for value in values if value is not None]
+            fill = fill[0] if fill else 0
+            data = np.array([fill if value is None else value
+                             for value in values])
+        else:
+            mask = None
+            chunks = [chunk.to_numpy(zero_copy_only=False)
+                      for chunk in column.chunks]
+            data = np.concatenate(chunks) if chunks else np.array([])
+        if data.dtype.kind in 'OU':
+            data = np.char.encode(data.astype('U'), 'utf-8')
+        if mask is not None:
+            data = MaskedColumn(data, mask=mask)
+        columns.append(data)
+
+    return Table(columns, names=atable.column_names)
+
+
+def write_columnar(table, filename, format, compression='zstd'):
+    """
+    write a table in a columnar format for downstream readers
+
+    format is one of COLUMNAR_FORMATS: 'parquet' and 'arrow' (Arrow IPC
+    file) need pyarrow and 'hdf5' needs h5py. The file is compressed
+    (zstd for parquet and arrow where the pyarrow version supports it,
+    gzip for hdf5) and written via a temporary file.
+
+    """
+    import os
+
+    if format not in COLUMNAR_FORMATS:
+        raise ValueError('Unknown output format: %s; use one of %s' %
+                         (format, ', '.join(sorted(COLUMNAR_FORMATS))))
+
+    tmpfile = filename + '.tmp'
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(_to_arrow(table), tmpfile, compression=compression)
+
+    if format == 'arrow':
+        import pyarrow as pa
+        atable = _to_arrow(table)
+        options = {}
+        if hasattr(pa.ipc, 'IpcWriteOptions'):
+            options['options'] = pa.ipc.IpcWriteOptions(
+                compression=compression)
+        sink = pa.OSFile(tmpfile, 'wb')
+        writer = pa.ipc.RecordBatchFileWriter(sink, atable.schema,
+                                              **options)
+        writer.write_table(atable)
+        writer.close()
+        sink.close()
+
+    if format == 'hdf5':
+        import numpy as np
+        from astropy.table import Table
+        columns = []
+        names = []
+        masks = []
+        for colname in table.colnames:
+            data = np.ma.getdata(table[colname])
+            if data.dtype.kind == 'M':
+                # HDF5 has no datetime type; seconds since 1970
+                data = data.astype('M8[s]').astype('i8')
+            columns.append(data)
+            names.append(colname)
+            # HDF5 has no masked values; the mask of a column with
+            # masked values is written as a boolean 'COLNAME mask'
+            # column, see read_columnar
+            mask = np.ma.getmaskarray(table[colname])
+            if mask.any():
+                masks.append((colname + HDF5_MASK, mask))
+        for colname, mask in masks:
+            columns.append(mask)
+            names.append(colname)
+        table = Table(columns, names=names)
+        table.write(tmpfile, format='hdf5', path='data',
+                    compression=True, overwrite=True)
+
+    os.rename(tmpfile, filename)
+
+
+def _datetime_column(column, dtype):
+    """
+    a date column read back from a file as datetime64 with the mask of
+    a masked column kept and the masked values NaT; a masked column
+    cannot be cast directly as its fill value does not convert
+
+    """
+    import numpy as np
+    from astropy.table import MaskedColumn
+
+    values = np.ma.getdata(column).astype(dtype)
+    if hasattr(column, 'mask'):
+        mask = np.ma.getmaskarray(column)
+        values[mask] = np.datetime64('NaT')
+        values = MaskedColumn(values, mask=mask)
+
+    return values
+
+
+def read_columnar(filename, columns=None):
+    """
+    read a table written by write_columnar reading only the requested
+    columns e.g. ['RA (hrs)', 'DEC (deg)', 'OB status']
+
+    parquet and Arrow IPC files are memory mapped so only the pages of
+    the requested columns are read; for hdf5 only the requested fields
+    of the compound dataset, and their mask fields, are read. Masked
+    values are masked again in every format.
+
+    returns an astropy table
+
+    """
+    import os
+    from astropy.table import Table, MaskedColumn
+
+    ext = os.path.splitext(filename)[1]
+
+    if ext == COLUMNAR_FORMATS['parquet']:
+        import pyarrow.parquet as pq
+        atable = pq.read_table(filename, columns=columns, memory_map=True)
+
+    elif ext == COLUMNAR_FORMATS['arrow']:
+        import pyarrow as pa
+        source = pa.memory_map(filename, 'r')
+        atable = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            atable = pa.Table.from_arrays(
+                [atable.column(name) for name in columns], names=columns)
+
+    elif ext == COLUMNAR_FORMATS['hdf5']:
+        import h5py
+        with h5py.File(filename, 'r') as fh:
+            dataset = fh['data']
+            names = dataset.dtype.names
+            if columns is None:
+                columns = [name for name in names
+                           if not (name.endswith(HDF5_MASK) and
+                                   name[:-len(HDF5_MASK)] in names)]
+            fields = list(columns) + [colname + HDF5_MASK
+                                      for colname in columns
+                                      if colname + HDF5_MASK in names]
+            data = dataset[tuple(fields)] if len(fields) > 1 \
+                else dataset[fields[0]]
+        table = Table()
+        for colname in columns:
+            values = data if len(fields) == 1 else data[colname]
+            if colname + HDF5_MASK in fields:
+                values = MaskedColumn(values,
+                                      mask=data[colname + HDF5_MASK])
+            table[colname] = values
+
+    else:
+        raise ValueError('Unknown columnar file extension: ' + filename)
+
+    if ext != COLUMNAR_FORMATS['hdf5']:
+        table = _from_arrow(atable)
+
+    # parquet keeps dates with millisecond resolution and hdf5 as
+    # seconds since 1970
+    for colname, dtype in PROGRESS_SCHEMA:
+        if dtype.startswith('M8') and colname in table.colnames:
+            table[colname] = _datetime_column(table[colname], dtype)
+
+    return table
+
+
+def read_table(filename):
+    """
+    read back a table written by write_table; the ISO string date
+    columns are converted back to the datetime64 dtype of the schema
+
+    A FITS file with any empty value is read as a masked table; the
+    date columns are converted from the data with the mask kept since
+    a masked string column cannot be cast to datetime64. Masked float
+    values are written to FITS as NaN and are masked again.
+
+    """
+    import numpy as np
+    from astropy.table import Table, MaskedColumn
+
+    table = Table.read(filename)
+    for colname, dtype in PROGRESS_SCHEMA:
+        if dtype.startswith('M8') and colname in table.colnames \
+                and table[colname].dtype.kind in 'SU':
+            table[colname] = _datetime_column(table[colname], dtype)
+        elif dtype.startswith('f') and colname in table.colnames \
+                and table[colname].dtype.kind == 'f':
+            column = table[colname]
+            nan = np.isnan(np.ma.getdata(column))
+            if nan.any():
+                table[colname] = MaskedColumn(
+                    np.ma.getdata(column),
+                    mask=np.ma.getmaskarray(column) | nan)
+
+    return table
+
+
+def stack_tables(tables):
+    """
+    stack the per run tables into the summary table
+
+    The string columns of each run table are as wide as the longest
+    value in that run so the common dtype of each column (widest string,
+    numeric promotion) is worked out first and every table is cast to it
+    before the tables are stacked. Columns missing from a run are
+    masked.
+
+    """
+    import numpy as np
+    from astropy.table import Table, vstack
+
+    if len(tables) == 0:
+        return Table()
+
+    colnames = []
+    dtypes = {}
+    for table in tables:
+        for colname in table.colnames:
+            dtype = table[colname].dtype
+            if colname not in dtypes:
+                colnames.append(colname)
+                dtypes[colname] = dtype
+            elif dtypes[colname] != dtype:
+                dtypes[colname] = np.promote_types(dtypes[colname], dtype)
+
+    unified = []
+    for table in tables:
+        table = table.copy(copy_data=False)
+        for colname in table.colnames:
+            if table[colname].dtype != dtypes[colname]:
+                table.replace_column(
+                    colname, table[colname].astype(dtypes[colname]))
+        unified.append(table)
+
+    if len(unified) == 1:
+        return unified[0]
+
+    stacked = vstack(unified, join_type='outer',
+                     metadata_conflicts='silent')
+
+    return stacked[colnames]
+
+
+# plot stage processes started by start_plots
+PLOT_PROCESSES = []
+
+
+def _pyplot():
+    """
+    import pyplot on first use; matplotlib is only imported when there
+    are plots to make
+
+    """
+    import sys
+    import matplotlib
+
+    # set the backend before importing pyplot to avoid DISPLAY problems
+    if 'matplotlib.pyplot' not in sys.modules:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def _plot_data(data):
+    """
+    a table column as a float array with masked values as NaN
+
+    """
+    import numpy as np
+
+    return np.ma.filled(np.ma.asarray(data, dtype='f8'), np.nan)
+
+
+def density_image(plt, xdata, ydata, status=None,
+                  xrange=None, yrange=None, bins=(240, 100)):
+    """
+    draw the density of points binned in 2D on the current axes with
+    each bin coloured by the most common OB status in it
+
+    The points are binned with a single np.bincount over (status, y, x)
+    so the time is linear in the number of points and the memory and
+    rendering time only depend on the number of bins. The brightness
+    of a bin is the log of its count.
+
+    returns the number of points in the ranges and a list of
+    (status, count) tuples
+
+    """
+    import numpy as np
+    import matplotlib.patches as mpatches
+
+    xdata = _plot_data(xdata)
+    ydata = _plot_data(ydata)
+    if status is None:
+        status = np.array(['all'] * len(xdata))
+    status = np.asarray(status)
+
+    good = np.isfinite(xdata) & np.isfinite(ydata)
+    if xrange is None:
+        xrange = [np.min(xdata[good]), np.max(xdata[good])] \
+            if good.any() else [0.0, 1.0]
+    if yrange is None:
+        yrange = [np.min(ydata[good]), np.max(ydata[good])] \
+            if good.any() else [0.0, 1.0]
+    good &= (xdata >= xrange[0]) & (xdata <= xrange[1]) & \
+        (ydata >= yrange[0]) & (ydata <= yrange[1])
+    xdata = xdata[good]
+    ydata = ydata[good]
+    status = status[good]
+
+    nx, ny = bins
+    values, category = np.unique(status, return_inverse=True)
+    ncat = max(1, len(values))
+    xspan = float(xrange[1] - xrange[0]) or 1.0
+    yspan = float(yrange[1] - yrange[0]) or 1.0
+    ix = np.minimum(((xdata - xrange[0]) / xspan * nx).astype('i8'),
+                    nx - 1)
+    iy = np.minimum(((ydata - yrange[0]) / yspan * ny).astype('i8'),
+                    ny - 1)
+    counts = np.bincount((category * ny + iy) * nx + ix,
+                         minlength=ncat * ny * nx).reshape(ncat, ny, nx)
+
+    colours = plt.cm.tab10(np.arange(ncat) % 10)[:, :3]
+    total = counts.sum(axis=0)
+    image = np.ones((ny, nx, 4))
+    image[:, :, :3] = colours[np.argmax(counts, axis=0)]
+    image[:, :, 3] = np.log1p(total) / np.log1p(max(total.max(), 1))
+
+    plt.imshow(image, origin='lower', aspect='auto',
+               interpolation='nearest',
+               extent=[xrange[0], xrange[1], yrange[0], yrange[1]])
+
+    ncounts = counts.reshape(ncat, -1).sum(axis=1)
+    legend = [(value, int(n)) for value, n in zip(values, ncounts)]
+    plt.legend([mpatches.Patch(color=colour) for colour in colours],
+               ['%s: %d' % (value, n) for value, n in legend],
+               fontsize='small', loc='upper right', title='OB status')
+
+    return len(xdata), legend
+
+
+def plot_radec(ra, dec,
+               title=None, xlabel=None, ylabel=None,
+               rarange=None, decrange=None,
+               showplots=False, figfile=None,
+               status=None, density=False):
+    """
+
+    density: plot the binned density coloured by status rather than
+    every point; see density_image
+
+    """
+
+    import os
+    import numpy as np
+    plt = _pyplot()
+
+    # plt.setp(lines, edgecolors='None')
+    if figfile is None:
+        figfile = 'radec.png'
+
+    plt.figure(num=None, figsize=(9.0, 6.0))
+
+    plt.xlabel('RA')
+    if xlabel is not None:
+        plt.xlabel(xlabel)
+    plt.ylabel('Dec')
+    if ylabel is not None:
+        plt.ylabel(ylabel)
+    if title is not None:
+        plt.title(title)
+
+    ms = 1.0
+
+    xdata = _plot_data(ra)
+    ydata = _plot_data(dec)
+
+    print(np.nanmin(xdata), np.nanmax(xdata))
+    print(np.nanmin(ydata), np.nanmax(ydata))
+
+    # plt.xlim([0,360])
+    # plt.ylim([-90,30])
+
+    if density:
+        ndata, counts = density_image(plt, xdata, ydata, status=status,
+                                      xrange=rarange, yrange=decrange)
+        print('Number of data points binned:', ndata)
+    else:
+        ms = 1.0
+        plt.plot(xdata, ydata, 'og', markeredgecolor='b', ms=ms)
+        # plotid.plotid()
+
+        if rarange is not None:
+            plt.xlim(rarange)
+        if decrange is not None:
+            plt.ylim(decrange)
+
+        ndata = len(xdata)
+        print('Number of data points plotted:', ndata)
+        plt.legend(['n: ' + str(ndata)],
+                   fontsize='small',
+                   loc='upper right',
+                   numpoints=1, scatterpoints=1)
+
+    if showplots:
+        plt.show()
+
+    print('Saving:', figfile)
+    # via a temporary file as figfile may be hardlinked into the
+    # snapshot store
+    plt.savefig(figfile + '.tmp',
+                format=os.path.splitext(figfile)[1][1:] or None)
+    os.rename(figfile + '.tmp', figfile)
+    plt.close()
+
+
+def plot_raextime(xdata, ydata,
+                  title=None, xlabel=None, ylabel=None,
+                  rarange=None, decrange=None,
+                  showplots=False, figfile=None,
+                  status=None, density=False):
+    """
+
+    density: plot the binned density coloured by status rather than
+    every point; see density_image
+
+    """
+
+    import os
+    import numpy as np
+    plt = _pyplot()
+    # plt.setp(lines, edgecolors='None')
+
+    if figfile is None:
+        figfile = 'raextime.png'
+
+    plt.figure(num=None, figsize=(9.0, 6.0))
+
+    plt.xlabel('RA')
+    if xlabel is not None:
+        plt.xlabel(xlabel)
+    plt.ylabel('Execution Time(s)')
+    if ylabel is not None:
+        plt.ylabel(ylabel)
+    if title is not None:
+        plt.title(title)
+
+    ms = 1.0
+
+    xdata = _plot_data(xdata)
+    ydata = _plot_data(ydata)
+
+    print(np.nanmin(xdata), np.nanmax(xdata))
+    print(np.nanmin(ydata), np.nanmax(ydata))
+
+    # plt.xlim([0,360])
+    # plt.ylim([-90,30])
+
+    if density:
+        ndata, counts = density_image(plt, xdata, ydata, status=status,
+                                      xrange=rarange, yrange=decrange)
+        print('Number of data points binned:', ndata)
+    else:
+        ms = 1.0
+        plt.plot(xdata, ydata, 'og', markeredgecolor='b', ms=ms)
+        # plotid.plotid()
+
+        if rarange is not None:
+            plt.xlim(rarange)
+        if decrange is not None:
+            plt.ylim(decrange)
+
+        ndata = len(xdata)
+        print('Number of data points plotted:', ndata)
+        plt.legend(['n: ' + str(ndata)],
+                   fontsize='small', loc='upper right',
+                   numpoints=1, scatterpoints=1)
+
+    if showplots:
+        plt.show()
+
+    print('Saving:', figfile)
+    # via a temporary file as figfile may be hardlinked into the
+    # snapshot store
+    plt.savefig(figfile + '.tmp',
+                format=os.path.splitext(figfile)[1][1:] or None)
+    os.rename(figfile + '.tmp', figfile)
+    plt.close()
+
+
+def _figname(value):
+    """
+    a column value made safe for a filename e.g. OB status '+'
+
+    """
+    return ''.join(c if c.isalnum() else '_%02x' % ord(c)
+                   for c in value) or 'none'
+
+
+def plot_jobs(table, outpath, title='VHS Progress', density=False):
+    """
+    list the figures of a summary table: RA/Dec and RA/execution time
+    of all the OBs, of the OBs of each run and of each OB status
+
+    returns a list of (kind, figfile, xdata, ydata, status, title,
+    density) jobs for _plot_job
+
+    """
+    import os
+    import numpy as np
+
+    ra = _plot_data(table['RA (hrs)'])
+    dec = _plot_data(table['DEC (deg)'])
+    extime = _plot_data(table['Execution time (s)'])
+    status = np.asarray(table['OB status'])
+
+    selections = [('', title, np.ones(len(table), dtype=bool))]
+    for colname, name, label in [('run ID', 'run', 'run'),
+                                 ('OB status', 'status', 'OB status')]:
+        values = np.asarray(table[colname])
+        for value in np.unique(values):
+            selections.append(('_%s_%s' % (name, _figname(value)),
+                               '%s: %s %s' % (title, label, value),
+                               values == value))
+
+    jobs = []
+    for suffix, figtitle, select in selections:
+        jobs.append(('radec',
+                     os.path.join(outpath, 'progress_radec%s.png' % suffix),
+                     ra[select], dec[select], status[select], figtitle,
+                     density))
+        jobs.append(('raextime',
+                     os.path.join(outpath,
+                                  'progress_ra_executiontime%s.png' % suffix),
+                     ra[select], extime[select], status[select], figtitle,
+                     density))
+
+    return jobs
+
+
+def _plot_job(job):
+    """
+    make one figure of plot_jobs in a plot stage worker process
+
+    """
+    kind, figfile, xdata, ydata, status, title, density = job
+    if kind == 'radec':
+        plot_radec(xdata, ydata, title=title, figfile=figfile,
+                   rarange=[0.0, 24.0], decrange=[-90.0, 10.0],
+                   status=status, density=density)
+    else:
+        plot_raextime(xdata, ydata, title=title, figfile=figfile,
+                      rarange=[0.0, 24.0], status=status, density=density)
+
+    return figfile
+
+
+def make_plots(fitsfile, nprocs=4, density=False):
+    """
+    plot stage: make the figures of a summary FITS file (see plot_jobs)
+    alongside it with a pool of nprocs processes
+
+    returns the list of figure files
+
+    """
+    import os
+    from multiprocessing import Pool
+
+    print('Reading:', fitsfile)
+    table = read_table(fitsfile)
+    jobs = plot_jobs(table, os.path.dirname(fitsfile) or '.',
+                     title='VHS Progress: ' + fitsfile, density=density)
+    del table
+    print('Number of figures:', len(jobs))
+
+    pool = Pool(max(1, nprocs))
+    try:
+        figfiles = pool.map(_plot_job, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return figfiles
+
+
+def start_plots(fitsfile, args, logfile, buildfile=None, digest=None):
+    """
+    start the plot stage (make_plots) of a summary FITS file in a
+    separate process which is not waited for; its output goes to
+    logfile and the snapshot is stored again when it has finished
+    unless args.nostore. logfile must not be in the snapshot
+    directory as it is still being written when the snapshot is
+    stored.
+
+    When all the figures have been made the plot stage records them
+    in the build record buildfile as made from the inputs digest (see
+    build_uptodate) so a failed or unfinished plot stage is never
+    taken as up to date.
+
+    Finished plot processes of earlier calls are reaped so that watch
+    does not accumulate zombies.
+
+    returns the subprocess.Popen
+
+    """
+    import os
+    import sys
+    import subprocess
+
+    PLOT_PROCESSES[:] = [process for process in PLOT_PROCESSES
+                         if process.poll() is None]
+
+    command = [sys.executable, os.path.abspath(__file__),
+               '--plots', fitsfile, '--plotprocs', str(args.plotprocs)]
+    if args.density:
+        command.append('--density')
+    if args.nostore:
+        command.append('--nostore')
+    if buildfile is not None:
+        command += ['--plotsbuild', buildfile, '--plotsdigest', digest]
+
+    with open(logfile, 'w') as fh:
+        process = subprocess.Popen(command, stdout=fh,
+                                   stderr=subprocess.STDOUT,
+                                   close_fds=True)
+    PLOT_PROCESSES.append(process)
+    print('Plot stage started:', process.pid, 'log:', logfile)
+
+    return process
+
+
+def getargs(verbose=False):
+    """
+
+    Template getargs function
+
+    Usage
+
+    python getargs.py --help
+
+
+    def getargs():
+
+    ....
+
+    if __name__=='__main__':
+
+        args = getargs()
+        debug = args.debug()
+
+
+
+    parse command line arguements
+
+    not all args are active
+
+    """
+    import sys
+    import pprint
+    import argparse
+
+    # there is probably a version function out there
+    __version__ = '0.1'
+
+    description = 'progresscsv command line arguements'
+    epilog = """WARNING: Not all options may be supported\n"""
+
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    # the destination defaults to the option parameter
+    # defaul=False might not be needed
+
+    # default type is string
+    parser.add_argument("--string",
+                        help="string input")
+
+    parser.add_argument("--float", type=float,
+                        help="float input")
+
+    parser.add_argument("--infile",
+                        help="Input file name")
+
+    parser.add_argument("--configfile",
+                        default=None,
+                        help="configuration file")
+
+    parser.add_argument("--stats",
+                        action='store_true',
+                        help="Compute stats")
+
+    parser.add_argument("--refresh",
+                        action='store_true',
+                        help="ignore the ETag/Last-Modified cache and " +
+                        "download every run file")
+
+    parser.add_argument("--format", action='append', default=[],
+                        choices=sorted(COLUMNAR_FORMATS),
+                        help="also write the per-run and summary tables " +
+                        "in a columnar format; may be repeated")
+
+    parser.add_argument("--history",
+                        action='store_true',
+                        help="query the OB history database and exit; " +
+                        "see --obid, --runid, --status, --since, --until")
+
+    parser.add_argument("--obid", type=int,
+                        help="OB ID for --history")
+
+    parser.add_argument("--runid",
+                        help="run ID for --history e.g. 198A2001A")
+
+    parser.add_argument("--status",
+                        help="OB status for --history e.g. C")
+
+    parser.add_argument("--since",
+                        help="first snapshot date YYYYMMDD for --history")
+
+    parser.add_argument("--until",
+                        help="last snapshot date YYYYMMDD for --history")
+
+    parser.add_argument("--backfill",
+                        action='store_true',
+                        help="load the existing snapshot directories into " +
+                        "the OB history database and exit")
+
+    parser.add_argument("--restart",
+                        action='store_true',
+                        help="ignore the --backfill checkpoint and start " +
+                        "from the first snapshot")
+
+    parser.add_argument("--nprocs", type=int, default=4,
+                        help="number of processes for --backfill")
+
+    parser.add_argument("--nostore",
+                        action='store_true',
+                        help="do not deduplicate the snapshot directory " +
+                        "into the content addressed store")
+
+    parser.add_argument("--cachesize", type=int, default=1024,
+                        help="size in MB of the parsed table cache " +
+                        "OUTPATH_ROOT/tablecache; 0 disables it")
+
+    parser.add_argument("--closed-days", type=float, default=365.0,
+                        help="a run file not modified for this many " +
+                        "days is treated as closed and no longer requested")
+
+    parser.add_argument("--recheck-days", type=float, default=7.0,
+                        help="a closed run file is checked for changes " +
+                        "with a conditional request every this many days")
+
+    parser.add_argument("--watch",
+                        action='store_true',
+                        help="stay resident and update the outputs when " +
+                        "the run files change; see --interval")
+
+    parser.add_argument("--interval", type=float, default=300.0,
+                        help="shortest poll interval in seconds of a " +
+                        "run file for --watch")
+
+    parser.add_argument("--maxinterval", type=float, default=86400.0,
+                        help="longest poll interval in seconds of a " +
+                        "run file and interval of the run discovery " +
+                        "for --watch")
+
+    parser.add_argument("--batch",
+                        action='store_true',
+                        help="process every program section of the " +
+                        "config file concurrently with one ESO login")
+
+    parser.add_argument("--relogin",
+                        action='store_true',
+                        help="ignore the saved ESO session and login again")
+
+    parser.add_argument("--nworkers", type=int, default=8,
+                        help="number of concurrent run file downloads")
+
+    parser.add_argument("--density",
+                        action='store_true',
+                        help="plot the binned density of the OBs " +
+                        "coloured by OB status rather than every OB")
+
+    parser.add_argument("--plots",
+                        metavar='FITSFILE',
+                        help="make the figures of a summary FITS file " +
+                        "and exit; normally started by the program run")
+
+    parser.add_argument("--plotprocs", type=int, default=4,
+                        help="number of processes of the plot stage")
+
+    parser.add_argument("--plotsbuild",
+                        metavar='BUILDFILE',
+                        help="with --plots record the figures in this " +
+                        "build record when they have all been made")
+
+    parser.add_argument("--plotsdigest",
+                        help="with --plotsbuild the digest of the " +
+                        "inputs of the figures")
+
+    parser.add_argument("--profile",
+                        action='store_true',
+                        help="profile each program with cProfile into " +
+                        "PROGRAM.prof in outpath")
+
+    parser.add_argument("--debug",
+                        action='store_true',
+                        help="debug option")
+
+    parser.add_argument("--pause",
+                        action='store_true',
+                        help="pause option")
+
+    parser.add_argument("--verbose", default=verbose,
+                        action='store_true',
+                        help="verbose option")
+
+    parser.add_argument("--version", action='store_true',
+                        help="verbose option")
+
+    args = parser.parse_args()
+
+    if args.debug or args.verbose:
+        print()
+        print('Number of arguments:', len(sys.argv),
+              'arguments: ', sys.argv[0])
+
+    if args.debug or args.verbose:
+        print()
+        for arg in vars(args):
+            print(arg, getattr(args, arg))
+        print()
+
+    if args.debug or args.verbose:
+        print()
+        pprint.pprint(args)
+        print()
+
+    if args.version:
+        print('version:', __version__)
+        sys.exit(0)
+
+    return args
+
+
+def getconfig(configfile=None, debug=False, silent=False):
+    """
+    read config file
+
+    Note the Python 2 ConfigParser module has been renamed to configparser
+    in Python 3 so it better to use import configparser in Python 2 for
+    future proofing
+
+    see also getconfig.cfg
+
+    TODO: catch exceptions
+
+    Support for lists:
+
+    see:
+
+    https://stackoverflow.com/questions/335695/lists-in-configparser
+
+    https://github.com/cacois/python-configparser-examples
+
+    look in cwd, home and home/.config
+
+    home/.config not implemented yet
+
+
+    """
+    import os
+    import configparser
+
+    # read the configuration file
+    # config = configparser.RawConfigParser()
+    config = configparser.SafeConfigParser()
+
+    print('__file__', __file__)
+    if configfile is None:
+        if debug:
+            print('__file__', __file__)
+        configfile_default = os.path.splitext(__file__)[0] + '.cfg'
+    if configfile is not None:
+        configfile_default = configfile
+
+    print('Open configfile:', configfile)
+    if debug:
+        print('Open configfile:', configfile)
+
+    try:
+        if not silent:
+            print('Reading config file', configfile)
+
+        try:
+            config.read(configfile)
+        except IOError:
+            print('config file', configfile, "does not exist")
+            configfile = os.path.join(os.environ["HOME"], configfile)
+            print('trying ', configfile)
+            config.read(configfile)
+
+    except Exception as e:
+        print('Problem reading config file: ', configfile)
+        print(e)
+
+    if debug:
+        print('configfile:', configfile)
+        print('sections:', config.sections())
+        for section_name in config.sections():
+            print('Section:', section_name)
+            print('Options:', config.options(section_name))
+            for name, value in config.items(section_name):
+                print('  %s = %s' % (name, value))
         print()
 
 
@@ -563,126 +2832,828 @@ def getconfig(configfile=None, debug=False, silent=False):
 
     return config
 
-def table_unique_info(table):
+
+def config_programs(config, section='vhs'):
+    """
+    list the programs in the config file for batch mode
+
+    Every section with a program option is a program. A section
+    without an outpath is written to a subdirectory named after the
+    program in the outpath of the default section. Each program needs
+    its own outpath since the run index, validators and current link
+    are per outpath.
+
+    returns a list of dicts with keys section, program, outpath and
+    historydb
+
+    """
+    import os
+
+    outpath_root = config.get(section, 'outpath')
+    programs = []
+    for name in config.sections():
+        if not config.has_option(name, 'program'):
+            continue
+        program = config.get(name, 'program')
+        outpath = os.path.join(outpath_root, program)
+        if config.has_option(name, 'outpath'):
+            outpath = config.get(name, 'outpath')
+        historydb = None
+        if config.has_option(name, 'historydb'):
+            historydb = config.get(name, 'historydb')
+        programs.append({'section': name, 'program': program,
+                         'outpath': outpath, 'historydb': historydb})
+
+    outpaths = [program['outpath'] for program in programs]
+    for outpath in set(outpaths):
+        if outpaths.count(outpath) > 1:
+            raise ValueError('outpath used by more than one program: ' +
+                             outpath)
+
+    return programs
+
+
+def previous_snapshot(outpath_root, date, filename):
     """
+    the latest YYYYMMDD snapshot directory before date that contains
+    filename e.g. PROGRAM.fits
 
+    returns the full path of filename or None
+
+    """
+    import os
+    import re
+
+    dates = [name for name in os.listdir(outpath_root)
+             if re.match(r'^\d{8}$', name) and name < date]
+    for name in sorted(dates, reverse=True):
+        path = os.path.join(outpath_root, name, filename)
+        if os.path.exists(path):
+            return path
+
+    return None
+
+
+def compute_delta(table, oldtable, key='OB ID',
+                  status='OB status', statusdate='Status date'):
+    """
+    OB level changes between two summary tables
+
+    The tables are joined on key with a sorted index of the old keys
+    (np.argsort + np.searchsorted) so the whole comparison is a few
+    vectorized passes over the columns. The tables may be masked e.g.
+    read back from FITS by read_table; masked dates are NaT and masked
+    statuses are empty.
+
+    returns a table with one row per changed OB and columns key,
+    'change', 'run ID', 'old ' and 'new ' status and status date where
+    change is one of
+
+      new: OB not in the old table
+      removed: OB not in the new table
+      status: status changed (the status date usually changes too)
+      date: only the status date changed
+
+    """
+    import numpy as np
+    from astropy.table import Table
+
+    def _match(keys, otherkeys):
+        # index into otherkeys of each of keys, -1 where not found
+        if len(otherkeys) == 0:
+            return np.zeros(len(keys), dtype='i8') - 1
+        sorter = np.argsort(otherkeys, kind='mergesort')
+        pos = np.searchsorted(otherkeys, keys, sorter=sorter)
+        pos = np.clip(pos, 0, len(otherkeys) - 1)
+        index = sorter[pos]
+        index[otherkeys[index] != keys] = -1
+        return index
+
+    def _data(column, dtype=None, fill=None):
+        # the values of a possibly masked column with the masked
+        # values set to fill
+        data = np.array(np.ma.getdata(column), dtype=dtype)
+        mask = np.ma.getmaskarray(column)
+        if fill is not None and mask.any():
+            data[mask] = fill
+        return data
+
+    newkeys = _data(table[key])
+    oldkeys = _data(oldtable[key])
+
+    if len(np.unique(newkeys)) != len(newkeys):
+        print('WARNING: duplicate', key, 'values in the summary; ' +
+              'comparing the first of each')
+
+    inew = _match(newkeys, oldkeys)
+    iold = _match(oldkeys, newkeys)
+
+    newstatus = _data(table[status], fill='')
+    oldstatus = _data(oldtable[status], fill='')
+    newdate = _data(table[statusdate], dtype='M8[s]',
+                    fill=np.datetime64('NaT'))
+    olddate = _data(oldtable[statusdate], dtype='M8[s]',
+                    fill=np.datetime64('NaT'))
+
+    matched = inew >= 0
+    statuschange = np.zeros(len(newkeys), dtype=bool)
+    datechange = np.zeros(len(newkeys), dtype=bool)
+    statuschange[matched] = newstatus[matched] != oldstatus[inew[matched]]
+    newmatched = newdate[matched].astype('M8[s]')
+    oldmatched = olddate[inew[matched]].astype('M8[s]')
+    datechange[matched] = (newmatched != oldmatched) & \
+        ~(np.isnat(newmatched) & np.isnat(oldmatched))
+    datechange &= ~statuschange
+
+    change = np.zeros(len(newkeys), dtype='S7')
+    change[~matched] = 'new'
+    change[statuschange] = 'status'
+    change[datechange] = 'date'
+    selected = change != ''
+    removed = iold < 0
+
+    runid = np.concatenate([np.asarray(table['run ID'])[selected],
+                            np.asarray(oldtable['run ID'])[removed]])
+
+    def _old(values, fill):
+        data = np.empty(selected.sum(), dtype=values.dtype)
+        data[:] = fill
+        index = inew[selected]
+        data[index >= 0] = values[index[index >= 0]]
+        return data
+
+    delta = Table()
+    delta[key] = np.concatenate([newkeys[selected], oldkeys[removed]])
+    delta['change'] = np.concatenate(
+        [change[selected], np.array(['removed'] * removed.sum(), dtype='S7')])
+    delta['run ID'] = runid
+    delta['old ' + status] = np.concatenate(
+        [_old(oldstatus, ''), oldstatus[removed]]).astype('S')
+    delta['new ' + status] = np.concatenate(
+        [newstatus[selected],
+         np.zeros(removed.sum(), dtype=newstatus.dtype)]).astype('S')
+    delta['old ' + statusdate] = np.concatenate(
+        [_old(olddate.astype('M8[s]'), np.datetime64('NaT')),
+         olddate[removed].astype('M8[s]')])
+    delta['new ' + statusdate] = np.concatenate(
+        [newdate[selected].astype('M8[s]'),
+         np.array(['NaT'] * removed.sum(), dtype='M8[s]')])
+
+    return delta
+
+
+def write_delta(delta, basename):
+    """
+    write the delta table as basename.fits, basename.csv and
+    basename.jsonl (one json object per changed OB)
+
+    """
+    import os
+    import json
+    import numpy as np
+
+    write_table(delta, basename + '.fits')
+    write_table(delta, basename + '.csv', format='ascii.csv')
+
+    columns = []
+    for colname in delta.colnames:
+        values = np.asarray(delta[colname])
+        if values.dtype.kind == 'M':
+            values = np.where(np.isnat(values), None,
+                              np.datetime_as_string(values))
+        columns.append(values.tolist())
+
+    tmpfile = basename + '.jsonl.tmp'
+    with open(tmpfile, 'w') as fh:
+        for row in zip(*columns):
+            fh.write(json.dumps(dict(zip(delta.colnames, row)),
+                                sort_keys=True) + '\n')
+    os.rename(tmpfile, basename + '.jsonl')
+
+
+def write_empty_delta(basename, key='OB ID', status='OB status',
+                      statusdate='Status date'):
+    """
+    write the delta files of a snapshot with no changes, as write_delta
+    does, without importing astropy; the FITS file is a binary table
+    with no rows
+
+    """
+    import os
+
+    colnames = [key, 'change', 'run ID', 'old ' + status, 'new ' + status,
+                'old ' + statusdate, 'new ' + statusdate]
+    formats = ['K', '7A', '1A', '1A', '1A', '1A', '1A']
+
+    def _card(keyword, value):
+        if isinstance(value, bool):
+            value = '%20s' % ('T' if value else 'F')
+        elif isinstance(value, int):
+            value = '%20d' % value
+        else:
+            value = "'%-8s'" % value
+        return ('%-8s= %s' % (keyword, value)).ljust(80)
+
+    def _hdu(cards):
+        header = ''.join(cards) + 'END'.ljust(80)
+        return header + ' ' * (-len(header) % 2880)
+
+    cards = [_card('XTENSION', 'BINTABLE'), _card('BITPIX', 8),
+             _card('NAXIS', 2),
+             _card('NAXIS1', sum(8 if tform == 'K' else int(tform[:-1])
+                                 for tform in formats)),
+             _card('NAXIS2', 0), _card('PCOUNT', 0), _card('GCOUNT', 1),
+             _card('TFIELDS', len(colnames))]
+    for i, (colname, tform) in enumerate(zip(colnames, formats)):
+        cards += [_card('TTYPE%d' % (i + 1), colname),
+                  _card('TFORM%d' % (i + 1), tform)]
+
+    contents = {
+        '.fits': _hdu([_card('SIMPLE', True), _card('BITPIX', 8),
+                       _card('NAXIS', 0), _card('EXTEND', True)]) +
+        _hdu(cards),
+        '.csv': ','.join(colnames) + '\n',
+        '.jsonl': ''}
+    for ext, content in contents.items():
+        tmpfile = basename + ext + '.tmp'
+        with open(tmpfile, 'w') as fh:
+            fh.write(content)
+        os.rename(tmpfile, basename + ext)
+
+
+def history_connect(dbfile):
     """
-    for colname in table.columns:
-        unique_data = np.unique(table[colname])
-        for id in unique_data:
-            itest = (table[colname] == id)
-        print(id, ':', len(data[itest]))
+    open the OB history database, creating the table and indexes
+
+    The history is a SQLite database with one row per OB change per
+    snapshot (see compute_delta); the first snapshot of a program has
+    every OB as 'new'. It is indexed on OB ID, run ID, OB status and
+    snapshot date so the history of an OB over years of snapshots is a
+    single index lookup.
+
+    """
+    import sqlite3
+
+    connection = sqlite3.connect(dbfile)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS ob_history (
+            program TEXT NOT NULL,
+            snapshot TEXT NOT NULL,
+            ob_id INTEGER NOT NULL,
+            run_id TEXT,
+            change TEXT NOT NULL,
+            ob_status TEXT,
+            status_date TEXT,
+            PRIMARY KEY (program, ob_id, snapshot));
+        CREATE INDEX IF NOT EXISTS ob_history_ob_id
+            ON ob_history (ob_id, snapshot);
+        CREATE INDEX IF NOT EXISTS ob_history_run_id
+            ON ob_history (run_id, snapshot);
+        CREATE INDEX IF NOT EXISTS ob_history_ob_status
+            ON ob_history (ob_status, snapshot);
+        CREATE INDEX IF NOT EXISTS ob_history_snapshot
+            ON ob_history (snapshot);
+        """)
+
+    return connection
+
+
+def history_append(dbfile, program, snapshot, delta):
+    """
+    add the OB changes of a snapshot (a compute_delta table) to the
+    history database; rerunning a snapshot replaces all its rows so
+    the changes of an earlier run of the same day that have since been
+    corrected are removed
+
+    returns the number of rows added
+
+    """
+    import numpy as np
+
+    dates = np.asarray(delta['new Status date'])
+    dates = np.where(np.isnat(dates), None, np.datetime_as_string(dates))
+    status = [value if value != '' else None
+              for value in np.asarray(delta['new OB status']).tolist()]
+
+    rows = zip([program] * len(delta), [snapshot] * len(delta),
+               np.asarray(delta['OB ID']).tolist(),
+               np.asarray(delta['run ID']).tolist(),
+               np.asarray(delta['change']).tolist(),
+               status, dates.tolist())
+
+    connection = history_connect(dbfile)
+    with connection:
+        connection.execute(
+            'DELETE FROM ob_history WHERE program = ? AND snapshot = ?',
+            (program, snapshot))
+        connection.executemany(
+            'INSERT OR REPLACE INTO ob_history VALUES (?, ?, ?, ?, ?, ?, ?)',
+            rows)
+    connection.close()
+
+    return len(rows)
+
+
+def history_query(dbfile, program=None, obid=None, runid=None,
+                  status=None, since=None, until=None):
+    """
+    query the OB history database
+
+    All the arguments are optional filters; since and until are
+    YYYYMMDD snapshot dates (inclusive). e.g. when did OB 123456 become
+    completed:
+
+        history_query(dbfile, obid=123456, status='C')[0]['snapshot']
+
+    returns a list of dicts in snapshot order
+
+    """
+    import sqlite3
+
+    where = []
+    values = []
+    for column, value, op in [('program', program, '='),
+                              ('ob_id', obid, '='),
+                              ('run_id', runid, '='),
+                              ('ob_status', status, '='),
+                              ('snapshot', since, '>='),
+                              ('snapshot', until, '<=')]:
+        if value is not None:
+            where.append('%s %s ?' % (column, op))
+            values.append(value)
+
+    sql = 'SELECT * FROM ob_history'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY snapshot, program, ob_id'
+
+    connection = history_connect(dbfile)
+    connection.row_factory = sqlite3.Row
+    rows = [dict(row) for row in connection.execute(sql, values)]
+    connection.close()
+
+    return rows
+
+
+def load_snapshot(snapshot, progid, cachedir=None, maxbytes=1 << 30):
+    """
+    the summary table of a YYYYMMDD snapshot directory; from the summary
+    FITS file if there is one otherwise by parsing the run csv files,
+    through the parsed table cache if cachedir is given
+
+    returns (snapshot, table, error) for use with a process pool; table
+    is None and error is a message if the directory cannot be read and
+    both are None if it has no summary FITS or run csv files
+
+    """
+    import os
+    import glob
+    import re
+
+    try:
+        fitsfile = os.path.join(snapshot, progid + '.fits')
+        if os.path.exists(fitsfile):
+            return snapshot, read_table(fitsfile), None
+
+        pattern = re.compile(re.escape(progid) + '[A-Z]+\.csv$')
+        runfiles = sorted([filename for filename in
+                           glob.glob(os.path.join(snapshot, progid + '*.csv'))
+                           if pattern.match(os.path.basename(filename))],
+                          key=lambda filename: (len(filename), filename))
+        if not runfiles:
+            return snapshot, None, None
+
+        if cachedir is None:
+            tables = [read_progress_csv(filename) for filename in runfiles]
+        else:
+            tables = [read_progress_cached(filename, cachedir,
+                                           maxbytes=maxbytes)
+                      for filename in runfiles]
+        return snapshot, stack_tables(tables), None
+
+    except Exception as err:
+        return snapshot, None, '%s: %s' % (type(err).__name__, err)
+
+
+def _load_snapshot(args):
+    return load_snapshot(*args)
 
 
-def tablecol_unique_info(table=None, colname=None, counts=True):
+def backfill(outpath_root, progid, historydb, nworkers=4, restart=False,
+             maxbytes=1 << 30):
     """
+    load the existing OUTPATH_ROOT/YYYYMMDD snapshot directories into the
+    OB history database
+
+    The snapshots are read by a pool of nworkers processes (see
+    load_snapshot) and the results are taken in date order to work out
+    the OB changes between consecutive snapshots (compute_delta) which
+    are added to the history (history_append). Progress is checkpointed
+    after every snapshot added to the history in
+    OUTPATH_ROOT/PROGRAM_backfill.json so an interrupted backfill
+    resumes where it stopped; restart ignores the checkpoint. The
+    backfill stops at a snapshot that cannot be read so that it is
+    loaded when the backfill is resumed; snapshots without any data
+    are skipped. Run files are parsed through the parsed table cache
+    OUTPATH_ROOT/tablecache of at most maxbytes.
+
+    returns the number of snapshots loaded
 
     """
-    data = table[colname]
-    unique_data = np.unique(data)
-    print('colume name:', colname)
-    print('Number of unique rows:', len(unique_data))
-    if counts:
-        for id in unique_data:
-            itest = (data == id)
-            print(id, ':', len(data[itest]))
-    print()
+    import os
+    import re
+    import json
+    import time
+    from multiprocessing import Pool
+
+    checkpointfile = os.path.join(outpath_root, progid + '_backfill.json')
+    cachedir = os.path.join(outpath_root, 'tablecache')
+
+    last = None
+    if os.path.exists(checkpointfile) and not restart:
+        with open(checkpointfile, 'r') as fh:
+            last = json.load(fh)['last']
+        print('Resuming backfill after:', last)
+
+    dates = sorted([name for name in os.listdir(outpath_root)
+                    if re.match(r'^\d{8}$', name)])
+
+    # the snapshot before the first one to load is needed for the delta
+    oldtable = None
+    if last is not None:
+        done = [date for date in dates if date <= last]
+        dates = [date for date in dates if date > last]
+        for date in reversed(done):
+            snapshot, oldtable, error = load_snapshot(
+                os.path.join(outpath_root, date), progid,
+                cachedir=cachedir, maxbytes=maxbytes)
+            if oldtable is not None:
+                break
+
+    print('Number of snapshots to backfill:', len(dates))
+    if len(dates) == 0:
+        return 0
 
-    return
+    start = time.time()
+    nloaded = 0
+    failed = False
+    pool = Pool(max(1, nworkers))
+    try:
+        jobs = [(os.path.join(outpath_root, date), progid, cachedir,
+                 maxbytes) for date in dates]
+        # imap returns the results in date order
+        for snapshot, table, error in pool.imap(_load_snapshot, jobs):
+            date = os.path.basename(snapshot)
+            if error is not None:
+                print('Cannot read snapshot:', snapshot, error)
+                print('Stopping the backfill; rerun to resume from:', date)
+                failed = True
+                break
+            if table is None:
+                print('Skipping snapshot without data:', snapshot)
+                continue
+
+            if oldtable is None:
+                oldtable = table[:0]
+            delta = compute_delta(table, oldtable)
+            nrows = history_append(historydb, progid, date, delta)
+            oldtable = table
+            nloaded += 1
+            print('Backfill:', date, 'OBs:', len(table),
+                  'changes:', nrows)
+
+            with open(checkpointfile + '.tmp', 'w') as fh:
+                json.dump({'last': date}, fh)
+            os.rename(checkpointfile + '.tmp', checkpointfile)
+
+            if nloaded > 0 and nloaded % 50 == 0:
+                elapsed = time.time() - start
+                print('Backfill throughput: %.2f days/second' %
+                      (nloaded / elapsed))
+    finally:
+        if failed:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
 
+    elapsed = time.time() - start
+    print('Backfilled', nloaded, 'snapshots in %.1f seconds' % elapsed,
+          '(%.2f days/second)' % (nloaded / max(elapsed, 1e-6)))
 
+    return nloaded
 
-if __name__ == '__main__':
 
-    import os
-    import sys
-    import re
-    import string
-    import traceback
-    import time
-    from time import strftime, gmtime
-    from optparse import OptionParser
+def table_value_counts(table, colnames=None):
+    """
+    value counts of the columns of a table
 
-    import ConfigParser
+    Each column is counted in a single vectorized pass with
+    np.unique(..., return_counts=True), which sorts the column once,
+    rather than a comparison against every unique value. Masked values
+    are counted as '--'.
 
+    returns a table with one row per column value with columns
+    'column', 'value' (as a string) and 'count'
 
+    """
     import numpy as np
+    from astropy.table import Table
+
+    if colnames is None:
+        colnames = table.colnames
+
+    columns = []
+    values = []
+    counts = []
+    for colname in colnames:
+        column = table[colname]
+        data = np.asarray(column)
+        nmasked = 0
+        mask = getattr(column, 'mask', None)
+        if mask is not None and np.any(mask):
+            nmasked = np.count_nonzero(mask)
+            data = data[~np.asarray(mask)]
+
+        unique_data, unique_counts = np.unique(data, return_counts=True)
+        if unique_data.dtype.kind == 'M':
+            unique_data = np.datetime_as_string(unique_data)
+
+        columns.extend([colname] * len(unique_data))
+        values.extend(unique_data.astype('S'))
+        counts.extend(unique_counts)
+        if nmasked > 0:
+            columns.append(colname)
+            values.append('--')
+            counts.append(nmasked)
+
+    return Table([np.array(columns, dtype='S'),
+                  np.array(values, dtype='S'),
+                  np.array(counts, dtype='i8')],
+                 names=('column', 'value', 'count'))
 
-    # use of MultipartPostHandler deprecated by DM in April 2019
-    # from MultipartPostHandler import MultipartPostHandler
-    # import MultipartPostHandler
-    # if debug:
-    # print('MultipartPostHandler.__file__:',
-    #      MultipartPostHandler.__file__)
 
-    import matplotlib
-    # set the backend before importing pyplot to avoid DISPLAY problems
-    matplotlib.use('Agg')
+def table_unique_info(table):
+    """
+    print the value counts of every column of a table
 
-    import astropy
-    print('astropy.__version__:', astropy.__version__)
-    from astropy.table import Table, vstack
+    """
+    tablecol_unique_info(table, colname=table.colnames)
 
-    table = True
-    append = False
-    date = False
 
-    # getargs overrides configfile values
-    args = getargs(verbose=False)
-    configfile = args.configfile
-    debug = args.debug
-    pause = args.pause
-    verbose = args.verbose
+def tablecol_unique_info(table=None, colname=None, counts=True):
+    """
+    print the number of unique values and optionally the value counts
+    of a column or list of columns; see table_value_counts
 
-    stats = args.stats
+    returns the table_value_counts table
 
-    # concatenate existing files by date
-    # append=1
-    # date='20120328'
-    # date='20120401'
+    """
+    colnames = colname
+    if not isinstance(colnames, list):
+        colnames = [colname]
+
+    valuecounts = table_value_counts(table, colnames)
+    for colname in colnames:
+        rows = valuecounts[valuecounts['column'] == colname]
+        print('colume name:', colname)
+        print('Number of unique rows:', len(rows))
+        if counts:
+            for value, count in zip(rows['value'], rows['count']):
+                print(value, ':', count)
+        print()
 
-    start = time.time()
+    return valuecounts
 
-    # the cfg file contains a password so it must be readonly
-    configfile = 'progresscsv.cfg'
-    security_check = _check_perms(configfile)
 
-    config = getconfig(configfile=configfile, debug=True)
+def peak_rss():
+    """
+    peak resident set size of the process in bytes
 
-    USERNAME = config.get('vhs', 'username')
-    PASSWORD = config.get('vhs', 'password')
-    PROGRAM = config.get('vhs', 'program')
-    OUTPATH_ROOT = config.get('vhs', 'outpath')
-    # could get from configfile or command line
-    progid = PROGRAM
+    """
+    import sys
+    import resource
 
-    # no changes should be needed below
-    if not date:
-        date = strftime("%Y%m%d", gmtime())
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes except on macOS
+    if sys.platform != 'darwin':
+        maxrss *= 1024
 
-    print('OUTPATH_ROOT:', OUTPATH_ROOT)
-    outpath = os.path.join(OUTPATH_ROOT, date)
-    print('outpath:' + outpath)
+    return maxrss
 
-    if not os.path.isdir(outpath):
-        os.mkdir(outpath)
 
-    # make convenience link to current progress files
+def write_metrics(metrics, outpath):
+    """
+    write the metrics of process_program as a json run report
+    PROGRAM_metrics.json and a Prometheus textfile collector file
+    PROGRAM.prom in outpath
+
+    The stages do not overlap: login (login_session), fetch (run
+    discovery and downloads), parse (csv parsing or loading of the run
+    tables), fits (writing the FITS and columnar files), tables (the
+    rest of the table stage e.g. the summary csv and stacking), delta,
+    stats, plots (starting the plot stage), store and total.
+
+    """
+    import os
+    import json
+
+    progid = metrics['program']
+
+    reportfile = os.path.join(outpath, progid + '_metrics.json')
+    with open(reportfile + '.tmp', 'w') as fh:
+        json.dump(metrics, fh, indent=2, sort_keys=True)
+    os.rename(reportfile + '.tmp', reportfile)
+
+    def _labels(**labels):
+        return '{' + ','.join('%s="%s"' % (name, labels[name])
+                              for name in sorted(labels)) + '}'
+
+    lines = []
+
+    def _metric(name, help, samples):
+        lines.append('# HELP progresscsv_%s %s\n' % (name, help))
+        lines.append('# TYPE progresscsv_%s gauge\n' % name)
+        for labels, value in samples:
+            lines.append('progresscsv_%s%s %s\n' %
+                         (name, _labels(**labels), repr(float(value))))
+
+    stages = ['login', 'fetch', 'parse', 'fits', 'tables', 'delta', 'stats',
+              'plots', 'store', 'total']
+    _metric('stage_seconds', 'Wall time of each stage in seconds.',
+            [({'program': progid, 'stage': stage}, metrics[stage])
+             for stage in stages if stage in metrics])
+    _metric('rows', 'Number of OBs in the summary.',
+            [({'program': progid}, metrics.get('nrows', 0))])
+    _metric('downloaded_bytes', 'Bytes of run files downloaded.',
+            [({'program': progid}, metrics.get('nbytes', 0))])
+    _metric('peak_rss_bytes', 'Peak resident set size in bytes.',
+            [({'program': progid}, metrics['peak_rss'])])
+    _metric('last_run_timestamp_seconds', 'Unix time of the last run.',
+            [({'program': progid}, metrics['timestamp'])])
+
+    runs = metrics.get('runs', {})
+    _metric('run_http_status', 'HTTP status of the run file request; ' +
+            '0 if no request was made.',
+            [({'program': progid, 'run': run}, runs[run]['status'] or 0)
+             for run in sorted(runs)])
+    _metric('run_cache_hit', '1 if the run file was not modified.',
+            [({'program': progid, 'run': run}, runs[run]['cache'] == 'hit')
+             for run in sorted(runs)])
+    _metric('run_downloaded_bytes', 'Bytes downloaded for the run file.',
+            [({'program': progid, 'run': run}, runs[run]['nbytes'])
+             for run in sorted(runs)])
+    _metric('run_rows', 'Number of OBs in the run file.',
+            [({'program': progid, 'run': run}, runs[run]['nrows'])
+             for run in sorted(runs) if 'nrows' in runs[run]])
+    _metric('run_rows_per_second', 'Rows per second parsing or loading ' +
+            'the run table.',
+            [({'program': progid, 'run': run}, runs[run]['rows_per_s'])
+             for run in sorted(runs) if 'rows_per_s' in runs[run]])
+
+    promfile = os.path.join(outpath, progid + '.prom')
+    with open(promfile + '.tmp', 'w') as fh:
+        fh.writelines(lines)
+    os.rename(promfile + '.tmp', promfile)
+
+    print('Metrics written:', reportfile, promfile)
+
+
+def update_current(outpath_root, outpath):
+    """
+    make convenience link to current progress files
+
+    """
+    import os
+
     # os.symlink(src, dest)
     # e.g ln -s /data/vhs/progress/20140727 /data/vhs/progress/current
     src = outpath
     print('src:', src)
-    dest = OUTPATH_ROOT + '/current'
+    dest = outpath_root + '/current'
     print('dest:', dest)
     if os.path.exists(dest):
         if os.path.islink(dest):
             os.unlink(dest)
     os.symlink(src, dest)
 
-    time_str = strftime("%Y-%m-%dT%H-%M-%S", gmtime())
 
-    # authenticate to ESO portal
-    opener = login(verbose=verbose, debug=debug, pause=pause)
+def process_program(opener, progid, outpath_root, args, date,
+                    historydb=None, append=False, tables=None, login=None):
+    """
+    download and process the progress csv files of one program
+
+    The run files, summary, delta and stats are written to
+    outpath_root/date using an opener from login_session and
+    outpath_root/current is linked to it. The plots are made afterwards
+    by a separate plot stage process which is not waited for; see
+    start_plots.
+
+    Only the products whose inputs have changed since they were last
+    built are rebuilt, the others are linked from the snapshot they
+    were built in; see build_uptodate and OUTPATH_ROOT/PROGRAM_build.json.
+    The summary ends at the first missing run file; an error processing
+    a run file that exists is raised and no summary is written so a
+    truncated summary is never recorded as built.
+
+    tables is an optional dict of the per run tables kept between
+    calls by watch; unchanged runs are taken from it rather than read
+    back from the FITS files.
+
+    The per stage and per run metrics are written to outpath; see
+    write_metrics. login is the time taken by login_session, which is
+    done by the caller. With args.profile the run is profiled with cProfile
+    into PROGRAM.prof and, where tracemalloc is available (Python 3),
+    the top memory allocations are written to PROGRAM_tracemalloc.txt.
+
+    returns the metrics dict with the number of OBs and the elapsed
+    time of each stage in seconds
+
+    """
+    import os
+    import time
+
+    outpath = os.path.join(outpath_root, date)
+
+    profiler = None
+    tracemalloc = None
+    if args.profile:
+        import cProfile
+        try:
+            import tracemalloc
+            tracemalloc.start()
+        except ImportError:
+            print('tracemalloc is not available; cProfile only')
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        metrics = _process_program(opener, progid, outpath_root, args, date,
+                                   historydb=historydb, append=append,
+                                   tables=tables)
+    finally:
+        # via temporary files as an earlier run of the day may have
+        # hardlinked the files into the snapshot store
+        if profiler is not None:
+            profiler.disable()
+            if os.path.isdir(outpath):
+                proffile = os.path.join(outpath, progid + '.prof')
+                profiler.dump_stats(proffile + '.tmp')
+                os.rename(proffile + '.tmp', proffile)
+            if tracemalloc is not None:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                tracefile = os.path.join(outpath,
+                                         progid + '_tracemalloc.txt')
+                with open(tracefile + '.tmp', 'w') as fh:
+                    for stat in snapshot.statistics('lineno')[:50]:
+                        fh.write(str(stat) + '\n')
+                os.rename(tracefile + '.tmp', tracefile)
+
+    if login is not None:
+        metrics['login'] = login
+    metrics['timestamp'] = time.time()
+    metrics['peak_rss'] = peak_rss()
+    print('Peak RSS:', metrics['peak_rss'], 'bytes')
+    write_metrics(metrics, outpath)
+
+    return metrics
+
+
+def _process_program(opener, progid, outpath_root, args, date,
+                     historydb=None, append=False, tables=None):
+    """
+    see process_program
+
+    """
+    import os
+    import sys
+    import string
+    import time
+
+    table = True
+
+    debug = args.debug
+    pause = args.pause
+    verbose = args.verbose
+    stats = args.stats
+    refresh = args.refresh
+    nworkers = args.nworkers
+    formats = args.format
+
+    if historydb is None:
+        historydb = os.path.join(outpath_root, 'progresscsv_history.sqlite')
+
+    # elapsed time of each stage
+    timings = {'program': progid}
+    start = time.time()
+
+    print('outpath_root:', outpath_root)
+    outpath = os.path.join(outpath_root, date)
+    print('outpath:' + outpath)
+
+    if not os.path.isdir(outpath):
+        os.makedirs(outpath)
 
     # Now loop through the csv files for each run
 
@@ -690,46 +3661,188 @@ if __name__ == '__main__':
     # each observing period has a separate file of form '179A2010[A to Z].csv'
     runfiles_all = progid + '.csv'
     outfile_csv_all = os.path.join(outpath, runfiles_all)
-    fh_csv_all = open(outfile_csv_all, 'w')
     fitsfile_all = progid + '.fits'
 
+    # ETag/Last-Modified of the run files from previous downloads
+    validators_file = os.path.join(outpath_root, progid + '_validators.json')
+    validators = {}
+    if not refresh:
+        validators = load_validators(validators_file, debug=debug)
+
+    # csv files have a preamble line added by ESO before the header
+    data_start = 2
+
     # loop through A-Z via string.uppercase which contains [A-Z]
-    for run in string.uppercase:
+    runs = string.uppercase
+    if not append:
+        # find the runs; the run index has the same json format as the
+        # validators
+        runindex_file = os.path.join(outpath_root, progid + '_runs.json')
+        runindex = {}
+        if not refresh:
+            runindex = load_validators(runindex_file, debug=debug)
+        live, closed = discover_runs(opener, progid, runindex,
+                                     nworkers=nworkers,
+                                     validators=validators,
+                                     recheck_days=args.recheck_days,
+                                     debug=debug or verbose)
+
+        # download all the run files concurrently; the summary is still
+        # assembled below in run order
+        fetched, missing = fetch_runs(opener, progid,
+                                      sorted(live + closed, key=run_order),
+                                      outpath, validators=validators,
+                                      closed=closed, stop_on_missing=False,
+                                      nworkers=nworkers,
+                                      debug=debug or verbose)
+        update_runindex(runindex, fetched, missing=missing,
+                        closed_days=args.closed_days)
+        save_validators(runindex_file, runindex)
+        runs = [run for run, info in fetched]
+        fetched = dict(fetched)
+
+        # per run metrics; see write_metrics
+        timings['runs'] = dict(
+            (run, {'status': info['status'], 'nbytes': info['nbytes'],
+                   'cache': 'hit' if info['notmodified'] else 'miss'})
+            for run, info in fetched.items())
+        timings['nbytes'] = sum(info['nbytes'] for info in fetched.values())
+    timings['fetch'] = time.time() - start
+    tstage = time.time()
+
+    # input hashes of the derived products; only the products whose
+    # inputs have changed are rebuilt, see build_uptodate
+    buildfile = os.path.join(outpath_root, progid + '_build.json')
+    build = {}
+    if not refresh:
+        build = load_validators(buildfile, debug=debug)
+    # the entries as loaded; only the changes are saved, see
+    # update_validators
+    build_loaded = dict(build)
+
+    # nothing to rebuild when no run file has changed since the
+    # snapshot they were all copied from; its products are linked and
+    # astropy and matplotlib are never imported
+    oldpath = None
+    if not append:
+        oldpath = unchanged_snapshot(
+            fetched, [run for run in live + closed if run not in missing],
+            validators)
+    products = [fitsfile_all, runfiles_all]
+    products += [progid + COLUMNAR_FORMATS[outformat]
+                 for outformat in formats]
+    if stats:
+        products.append(progid + '_stats.fits')
+    if oldpath is not None and \
+            [product for product in products
+             if not os.path.exists(os.path.join(oldpath, product))]:
+        oldpath = None
+    # the figures also depend on --density; the summary in oldpath is
+    # the one in the build record (linked) so its digest is current
+    if oldpath is not None:
+        entry = build.get(runfiles_all, {})
+        summary = os.path.join(entry.get('outpath') or oldpath, runfiles_all)
+        plots_digest = build_digest([str(entry.get('inputs')),
+                                     'density' if args.density else 'points'])
+        if not os.path.exists(summary) or \
+                not os.path.samefile(summary,
+                                     os.path.join(oldpath, runfiles_all)) or \
+                not build_uptodate(build, 'progress_*.png', plots_digest,
+                                   oldpath):
+            oldpath = None
+
+    if oldpath is not None:
+        print('No run file has changed since:', oldpath)
+        if os.path.abspath(oldpath) != os.path.abspath(outpath):
+            # nothing has changed since oldpath so the delta is empty
+            # and the metrics and profiles are of this run
+            nlinked = link_snapshot(
+                oldpath, outpath,
+                exclude=[progid + '_delta.', progid + '_metrics.',
+                         progid + '.prom', progid + '.prof',
+                         progid + '_tracemalloc.', progid + '_plots.'])
+            print('Files linked from previous snapshot:', nlinked)
+            write_empty_delta(os.path.join(outpath, progid + '_delta'))
+        for run in runs:
+            validators[run]['outpath'] = outpath
+        save_validators(validators_file, validators)
+        update_current(outpath_root, outpath)
+
+        with open(outfile_csv_all) as fh:
+            timings['nrows'] = max(0, sum(1 for line in fh) - data_start)
+        print('Number of rows in summary:', timings['nrows'])
+
+        tstage = time.time()
+        if not args.nostore:
+            store_snapshot(outpath_root, outpath, debug=debug)
+        timings['store'] = time.time() - tstage
+
+        elapsed = time.time() - start
+        timings['total'] = elapsed
+        print("Elapsed time:", elapsed, "seconds")
+        print()
+        return timings
+
+    import astropy
+    print('astropy.__version__:', astropy.__version__)
+
+    digests = {}
+    for run in runs:
+        runfile = os.path.join(outpath, progid + '%s.csv' % run)
+        if not os.path.exists(runfile):
+            break
+        digests[run] = build_digest([file_hash(runfile)])
+    summary_digest = build_digest([digests[run] for run in runs
+                                   if run in digests])
+    rebuilt = []
+
+    # typed tables of the run files by digest; see read_progress_cached
+    cachedir = os.path.join(outpath_root, 'tablecache')
+    cachesize = args.cachesize * 1024 * 1024
+
+    fh_csv_all = None
+    if not build_uptodate(build, runfiles_all, summary_digest, outpath):
+        fh_csv_all = open_summary(outfile_csv_all)
+        rebuilt.append(runfiles_all)
+    nrows_all = 0
+    runtables = []
+    timings['parse'] = 0.0
+    timings['fits'] = 0.0
+
+    for run in runs:
         runfile = progid + '%s.csv' % run
         fitsfile = progid + '%s.fits' % run
         print('Reading:', runfile)
 
         # try until ends the end of the run sequence
         try:
+            notmodified = False
             if not append:
-                # print('Reading via http:', runfile)
-                # using urllib2
-                urlcsv = "http://www.eso.org/observing/usg/status_pl/csv/" \
-                         + runfile
-                print('Reading: ', urlcsv)
-
-                # URL = "http://www.hole.fi/jajvirta/weblog/"
-                # req = urllib2.Request(URL)
-                # url_handle = urllib2.urlopen(req)
-                # headers = url_handle.info()
-                # etag = headers.getheader("ETag")
-                #last_modified = headers.getheader("Last-Modified")
-                httpheader = opener.open(urlcsv).info()
-                if debug or verbose:
-                    # help(opener)
-                    print('http header:', len(httpheader))
-                    print(httpheader)
-                    Etag = httpheader.getheader("ETag")
-                    print('Etag:', Etag)
-                    print()
-
-                last_modified = httpheader.getheader("Last-Modified")
-                print("Last-Modified:", last_modified,
-                      httpheader.getheader("ETag"))
-
-                result = opener.open(urlcsv).readlines()
-                print('Read remote file into readline list:',
-                      type(result), len(result))
+                ResultFile = os.path.join(outpath, runfile)
+                info = fetched[run]
+                notmodified = info['notmodified']
+                validator = validators.get(run, {})
+
+            if not append and notmodified:
+                print('Not modified since:', validator.get('last_modified'),
+                      validator.get('etag'))
+                validator['outpath'] = outpath
+
+            if not append and not notmodified:
+                print("Last-Modified:", info['last_modified'], info['etag'])
+                print('Downloaded:', info['nbytes'], 'bytes to', ResultFile)
+                validators[run] = {'etag': info['etag'],
+                                   'last_modified': info['last_modified'],
+                                   'outpath': outpath}
+
+            # the run file is only read into memory for the summary csv;
+            # the table is parsed from the file if it is not cached
+            INFILE = os.path.join(outpath, runfile)
+            result = None
+            if fh_csv_all is not None:
+                if append:
+                    print('Append: Reading:', INFILE)
+                result = open(INFILE, 'r').readlines()
                 if debug or verbose:
                     preamble = result[0]
                     print('preamble:', len(preamble))
@@ -739,85 +3852,84 @@ if __name__ == '__main__':
                     print('header:', len(header))
                     print(header)
 
-                # old URL
-                # result = opener.open("http://www.eso.org/observing/usg/status_pl/run/" + runfile).read()
                 print(type(result), len(result))
-            if pause:
-                raw_input("Press ENTER to continue: ")
-
-            if append:
-                INFILE = os.path.join(outpath, runfile)
-                print('Append: Reading:', INFILE)
-                if pause:
-                    raw_input("Press ENTER to continue: ")
-                result = open(INFILE, 'r').readlines()
-                print(result[0:1])
-                if pause:
-                    raw_input("Press ENTER to continue: ")
-                print(len(result), type(result))
-                if pause:
-                    raw_input("Press ENTER to continue: ")
-
-            print('Number of records read in:', len(result))
+                print('Number of records read in:', len(result))
 
             if pause:
                 raw_input("Press ENTER to continue: ")
 
-            if not append:
-                ResultFile = os.path.join(outpath, runfile)
-                print('Open:', ResultFile)
-                fh_csv = open(ResultFile, 'w')
-                tmp = string.join(result)
-                print('Write:', len(result), ResultFile)
-                fh_csv.write(tmp)
-                fh_csv.close()
-                print('Close:', ResultFile)
-
             # write fitsfile
-            if table:
-                # result is the ascii csv in memory
-                print('Read csv into table')
-                data_start = 2
-                header_start = 1
-                table = Table.read(result, format='ascii',
-                                   data_start=data_start,
-                                   header_start=header_start)
-                if debug or verbose:
-                    print('table.colnames:', table.colnames)
-                print('Number of rows:', len(table))
-                #if debug:
-                #    print('table.describe:', table.describe)
-                #    print('table.shape:', table.shape)
-                fitsfile = os.path.join(outpath, fitsfile)
+            # per run table; a run file with the same contents is read
+            # back from the FITS file of the snapshot it was built in
+            tparse = time.time()
+            digest = digests[run]
+            uptodate = build_uptodate(build, fitsfile, digest, outpath)
+            cached = None
+            if tables is not None:
+                cached = tables.get(run)
+            runtable = None
+            if cached is not None and cached[0] == digest:
+                runtable = cached[1]
+            elif cachesize > 0:
+                runtable = load_cached_table(cachedir, digest)
+            if runtable is None:
+                if uptodate:
+                    runtable = read_table(os.path.join(outpath, fitsfile))
+                else:
+                    # result is the ascii csv in memory if it was read
+                    print('Read csv into table')
+                    runtable = read_progress_csv(
+                        INFILE if result is None else result, debug=debug)
+                    if debug or verbose:
+                        print('table.colnames:', runtable.colnames)
+                if cachesize > 0:
+                    save_cached_table(cachedir, digest, runtable,
+                                      maxbytes=cachesize)
+
+            tparse = time.time() - tparse
+            timings['parse'] += tparse
+
+            tfits = time.time()
+            if not uptodate:
                 print('Writing FITs file:', fitsfile)
-                table.write(fitsfile, overwrite=True)
+                write_table(runtable, os.path.join(outpath, fitsfile))
                 print('Close FITs file:', fitsfile)
+                build[fitsfile] = {'inputs': digest, 'outpath': outpath}
+                rebuilt.append(fitsfile)
+            print('Number of rows:', len(runtable))
+            runtables.append(runtable)
+            if tables is not None and not append:
+                tables[run] = (digest, runtable)
+
+            # columnar copies
+            for outformat in formats:
+                outfile = progid + run + COLUMNAR_FORMATS[outformat]
+                if build_uptodate(build, outfile, digest, outpath):
+                    continue
+                print('Writing', outformat, 'file:', outfile)
+                write_columnar(runtable, os.path.join(outpath, outfile),
+                               outformat)
+                build[outfile] = {'inputs': digest, 'outpath': outpath}
+                rebuilt.append(outfile)
+            tfits = time.time() - tfits
+            timings['fits'] += tfits
+            if not append:
+                timings['runs'][run].update(
+                    {'nrows': len(runtable), 'seconds': tparse,
+                     'rows_per_s': len(runtable) / max(tparse, 1e-6),
+                     'fits_seconds': tfits})
 
-            # write the appended results; each ASCII write appends to
-            # opened file; ascii data is also appended in memory
-
-            # append the runfile input into a summary object
+            # append the runfile data rows to the summary csv; the
+            # header is only written once
             print('Run:', run)
-            if run == 'A':
-                summary = result
-                print('Number of rows:', len(result))
+            if fh_csv_all is not None:
+                nrows = append_summary(fh_csv_all, result,
+                                       nskip=data_start)
             else:
-                # Skip first line of column info that is in each file
-                # locate the first end of line with .read is used
-                # j = result.find('\n')
-                # fh.write(result[j+1:])
-                nskip = 2
-                print('Number of rows in previous summary:', len(summary))
-                print('Number of rows to be appended:', len(result) - nskip)
-                print('Writing appended csv file:', runfiles_all)
-
-                tmp = summary + result[nskip:]
-                summary = tmp
-                new = string.join(tmp)
-                print('Number of rows:', len(new))
-                fh_csv_all = open(os.path.join(outpath, runfiles_all), 'w')
-                fh_csv_all.write(new)
-                print('Write summary completed:', len(new), )
+                nrows = len(runtable)
+            nrows_all += nrows
+            print('Number of rows appended:', nrows)
+            print('Number of rows in summary:', nrows_all)
 
             print()
             if pause:
@@ -828,24 +3940,72 @@ if __name__ == '__main__':
             print("Unexpected error:", sys.exc_info()[0])
             print("Unexpected error:", sys.exc_info())
             print('Problem reading:', runfile)
+            if run in digests:
+                # the run file exists so the summary would be truncated
+                # but recorded as built from all the run files
+                if fh_csv_all is not None:
+                    fh_csv_all.close()
+                    os.remove(fh_csv_all.name)
+                raise
             print('Could be the end of the loop and runfile does not exist')
             print()
             print()
             break
 
-    fh_csv_all.close()
-    runfiles_all = progid + '.csv'
+    if fh_csv_all is not None:
+        close_summary(fh_csv_all, outfile_csv_all)
+        build[runfiles_all] = {'inputs': summary_digest, 'outpath': outpath}
+    print('Write summary completed:', outfile_csv_all, nrows_all)
+
+    if not append:
+        save_validators(validators_file, validators)
 
-    print('type(summary):', type(summary), len(summary))
-    # internal memory read of the summary data in ascii format
-    table = Table.read(summary, format='ascii',
-                       data_start=data_start,
-                       header_start=header_start)
+    # stack the per run tables rather than parsing the summary csv
+    table = stack_tables(runtables)
     print(table.colnames)
     print()
 
+    tfits = time.time()
     ResultFile = os.path.join(outpath, fitsfile_all)
-    table.write(ResultFile, overwrite=True)
+    for outfile in [fitsfile_all] + [progid + COLUMNAR_FORMATS[outformat]
+                                     for outformat in formats]:
+        if build_uptodate(build, outfile, summary_digest, outpath):
+            continue
+        if outfile == fitsfile_all:
+            write_table(table, ResultFile)
+        else:
+            outformat = [outformat for outformat in formats
+                         if outfile == progid + COLUMNAR_FORMATS[outformat]]
+            print('Writing', outformat[0], 'file:', outfile)
+            write_columnar(table, os.path.join(outpath, outfile),
+                           outformat[0])
+        build[outfile] = {'inputs': summary_digest, 'outpath': outpath}
+        rebuilt.append(outfile)
+    timings['fits'] += time.time() - tfits
+    timings['tables'] = time.time() - tstage - timings['parse'] - \
+        timings['fits']
+    tstage = time.time()
+
+    # OB level changes since the previous snapshot; every OB is new
+    # in the first snapshot
+    oldfitsfile = previous_snapshot(outpath_root, date, fitsfile_all)
+    if oldfitsfile is None:
+        print('No previous snapshot to compare with')
+        oldtable = table[:0]
+    else:
+        print('Changes since:', oldfitsfile)
+        oldtable = read_table(oldfitsfile)
+    delta = compute_delta(table, oldtable)
+    write_delta(delta, os.path.join(outpath, progid + '_delta'))
+    for change in ['new', 'removed', 'status', 'date']:
+        print('Number of OBs', change + ':',
+              (delta['change'] == change).sum())
+
+    nhistory = history_append(historydb, progid, date, delta)
+    print('OB history:', historydb, 'rows added:', nhistory)
+    timings['delta'] = time.time() - tstage
+    timings['nrows'] = len(table)
+
     end = time.time()
     elapsed = end - start
     print("Summary file created:", ResultFile)
@@ -853,7 +4013,6 @@ if __name__ == '__main__':
     print()
 
     fitsfile = outpath + '/' + fitsfile_all
-    figfile = outpath + '/' + 'progress_radec.png'
     print('Reading:', fitsfile)
     table.read(fitsfile)
     print(table.colnames)
@@ -862,69 +4021,429 @@ if __name__ == '__main__':
     table.info('stats')
     print()
 
+    tstage = time.time()
+    statsfiles = [progid + '_stats.fits', progid + '_stats.csv']
+    if stats and [statsfile for statsfile in statsfiles
+                  if not build_uptodate(build, statsfile, summary_digest,
+                                        outpath)]:
+
+        # value counts of the columns in one table alongside the FITS
+        colnames = ['run ID', 'OB ID', 'OB status', 'Status date',
+                    'OB name', 'OD name', 'Execution time (s)',
+                    'Container type', 'Container ID', 'Seeing',
+                    'Sky transparency', 'FLI']
+        colnames = [colname for colname in colnames
+                    if colname in table.colnames]
+        statstable = table_value_counts(table, colnames)
+
+        for colname in colnames:
+            print('colume name:', colname,
+                  'Number of unique rows:',
+                  (statstable['column'] == colname).sum())
+        print()
 
+        statsfile = os.path.join(outpath, progid + '_stats.fits')
+        print('Writing stats file:', statsfile)
+        write_table(statstable, statsfile)
+        write_table(statstable, os.path.splitext(statsfile)[0] + '.csv',
+                    format='ascii.csv')
+        for statsfile in statsfiles:
+            build[statsfile] = {'inputs': summary_digest, 'outpath': outpath}
+        rebuilt += statsfiles
+    timings['stats'] = time.time() - tstage
 
-    if stats:
+    end = time.time()
+    elapsed = end - start
+    print("Elapsed time:", elapsed, "seconds")
+    print()
+
+    # the figures depend on --density as well as the summary
+    plots_digest = build_digest([summary_digest,
+                                 'density' if args.density else 'points'])
+    plots = not build_uptodate(build, 'progress_*.png', plots_digest,
+                               outpath)
+    if plots:
+        rebuilt.append('progress_*.png')
+    # a plot stage still running from an earlier run may record the
+    # figures meanwhile; only save the entries changed by this run
+    update_validators(buildfile,
+                      dict((product, entry) for product, entry
+                           in build.items()
+                           if build_loaded.get(product) != entry))
+    timings['rebuilt'] = rebuilt
+    print('Products rebuilt:', len(rebuilt), rebuilt)
+
+    update_current(outpath_root, outpath)
+
+    # keep one copy of unchanged files across the daily snapshots
+    tstage = time.time()
+    if not args.nostore:
+        store_snapshot(outpath_root, outpath, debug=debug)
+    timings['store'] = time.time() - tstage
+
+    # the figures are made off the critical path; the plot stage
+    # stores the snapshot again when they are written. The log of the
+    # latest plot stage is kept outside the snapshot directories
+    tstage = time.time()
+    if plots:
+        start_plots(fitsfile, args,
+                    os.path.join(outpath_root, progid + '_plots.log'),
+                    buildfile=buildfile, digest=plots_digest)
+    timings['plots'] = time.time() - tstage
 
-        colname='run ID'
-        tablecol_unique_info(table, colname)
+    end = time.time()
+    elapsed = end - start
+    timings['total'] = elapsed
+    print("Elapsed time:", elapsed, "seconds")
+    print()
 
-        colname='OB ID'
-        tablecol_unique_info(table, colname, counts=False)
+    return timings
 
-        colname='OB status'
-        tablecol_unique_info(table, colname)
 
-        colname='Status date'
-        tablecol_unique_info(table, colname, counts=False)
+def run_programs(opener, programs, args, date, append=False, login=None):
+    """
+    process several programs concurrently sharing one ESO session;
+    login is the time taken by the shared login_session
 
-        colname='OB name'
-        tablecol_unique_info(table, colname, counts=False)
+    A failed program does not stop the others; its error is returned
+    in place of the timings.
 
-        colname='OD name'
-        tablecol_unique_info(table, colname, counts=True)
+    programs is a list from config_programs; returns a list of the
+    process_program timings in the same order
 
-        colname = 'Execution time (s)'
-        tablecol_unique_info(table, colname)
+    """
+    import traceback
+    from multiprocessing.pool import ThreadPool
 
-        colname = 'Container type'
-        tablecol_unique_info(table, colname)
+    def _process(program):
+        try:
+            return process_program(opener, program['program'],
+                                   program['outpath'], args, date,
+                                   historydb=program['historydb'],
+                                   append=append, login=login)
+        except Exception as err:
+            traceback.print_exc()
+            print('Problem processing:', program['program'], err)
+            return {'program': program['program'], 'error': str(err)}
+
+    pool = ThreadPool(max(1, len(programs)))
+    try:
+        results = pool.map(_process, programs)
+    finally:
+        pool.close()
+        pool.join()
 
-        colname = 'Container ID'
-        tablecol_unique_info(table, colname, counts=False)
+    return results
 
-        colname = 'Seeing'
-        tablecol_unique_info(table, colname, counts=True)
 
-        colname = 'Sky transparency'
-        tablecol_unique_info(table, colname, counts=True)
+def print_timings(results, elapsed=None):
+    """
+    print a table of the per stage time taken by each program
 
-        colname = 'FLI'
-        tablecol_unique_info(table, colname, counts=True)
+    """
+    stages = ['login', 'fetch', 'parse', 'fits', 'tables', 'delta', 'stats',
+              'plots', 'store', 'total']
 
-    end = time.time()
-    elapsed = end - start
-    print("Elapsed time:", elapsed, "seconds")
     print()
-
-    ra = table['RA (hrs)']
-    dec = table['DEC (deg)']
-    executionTime = table['Execution time (s)']
+    print('%-16s %8s' % ('program', 'nrows') +
+          ''.join(' %8s' % stage for stage in stages))
+    for result in results:
+        if 'error' in result:
+            print('%-16s ERROR: %s' % (result['program'], result['error']))
+            continue
+        print('%-16s %8d' % (result['program'], result['nrows']) +
+              ''.join(' %8.2f' % result.get(stage, 0.0)
+                      for stage in stages))
+    if elapsed is not None:
+        total = sum(result.get('total', 0.0) for result in results)
+        print('Wall time:', elapsed, 'seconds;',
+              'sum of program times:', total, 'seconds')
     print()
 
-    plot_radec(ra, dec, title='VHS Progress: ' + fitsfile,
-               figfile=figfile,
-               rarange=[0.0, 24.0],
-               decrange=[-90.0, 10.0])
 
-    figfile = outpath + '/' + 'progress_ra_executiontime.png'
-    plot_raextime(ra, executionTime,
-                  title='VHS Progress: ' + fitsfile,
-                  figfile=figfile,
-                  rarange=[0.0, 24.0])
+def watch(sessionfile, programs, args, mininterval=300.0,
+          maxinterval=86400.0):
+    """
+    stay resident and update the outputs of the programs when their
+    run files change
+
+    Each run file is checked on its own schedule with a conditional
+    HEAD request (see check_run). The poll interval of a run is reset
+    to mininterval when it changes and doubled up to maxinterval when
+    it has not, so the runs of the active period are polled often and
+    old ones rarely; closed runs are polled every maxinterval. A run
+    file that has gone is marked missing in the run index and no longer
+    polled. The runs are discovered again (see discover_runs) every
+    maxinterval so the run files of a new period are picked up. A
+    program is rebuilt by process_program when a run has changed or
+    a new run is found and once a day for the new snapshot directory.
+    The ESO session and the per run tables are kept between rebuilds.
+
+    Stops on SIGTERM or Control-C.
+
+    """
+    import os
+    import time
+    import signal
+    import traceback
+    from time import strftime, gmtime
+
+    def _stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _stop)
+
+    debug = args.debug
+    verbose = args.verbose
+
+    opener = login_session(sessionfile, relogin=args.relogin,
+                           verbose=verbose, debug=debug)
+
+    # per program tables; (program, run): [interval, next poll]
+    tables = dict((program['program'], {}) for program in programs)
+    polls = {}
+    built = {}
+    # time of the last run discovery by program
+    discovered = {}
+
+    try:
+        while True:
+            date = strftime("%Y%m%d", gmtime())
+            failed = False
+            for program in programs:
+                progid = program['program']
+                outpath_root = program['outpath']
+                rebuild = built.get(progid) != date
+
+                runindex_file = os.path.join(outpath_root,
+                                             progid + '_runs.json')
+                runindex = load_validators(runindex_file)
+                validators = load_validators(
+                    os.path.join(outpath_root, progid + '_validators.json'))
+
+                # process_program discovers the runs when it rebuilds
+                if not rebuild and \
+                        time.time() - discovered.get(progid, 0) > maxinterval:
+                    before = dict((run, entry.get('status'))
+                                  for run, entry in runindex.items())
+                    live, closed = discover_runs(
+                        opener, progid, runindex, nworkers=args.nworkers,
+                        validators=validators,
+                        recheck_days=args.recheck_days, debug=debug)
+                    save_validators(runindex_file, runindex)
+                    discovered[progid] = time.time()
+                    new = [run for run in live
+                           if runindex.get(run, {}).get('status') == 'live'
+                           and before.get(run) != 'live']
+                    if new:
+                        print('New run files:', progid, ''.join(new))
+                        rebuild = True
+
+                nchecked = 0
+                for run in sorted(runindex, key=run_order):
+                    status = runindex[run].get('status')
+                    if status not in ('live', 'closed'):
+                        polls.pop((progid, run), None)
+                        continue
+                    now = time.time()
+                    interval = mininterval
+                    if status == 'closed':
+                        interval = maxinterval
+                    interval, nextpoll = polls.setdefault(
+                        (progid, run), [interval, now + interval])
+                    if nextpoll > now:
+                        continue
+
+                    url = CSV_URL + progid + '%s.csv' % run
+                    changed = check_run(opener, url, validators.get(run),
+                                        debug=debug)
+                    nchecked += 1
+                    if changed == 'missing':
+                        print('Run file no longer exists:', progid + run)
+                        runindex[run] = {'status': 'missing'}
+                        save_validators(runindex_file, runindex)
+                        polls.pop((progid, run))
+                        continue
+                    if changed:
+                        print('Run file changed:', progid + run)
+                        interval = mininterval
+                        rebuild = True
+                        if status == 'closed':
+                            # reopen so that fetch_runs requests it
+                            runindex[run]['status'] = 'live'
+                            save_validators(runindex_file, runindex)
+                    elif changed is False:
+                        interval = min(maxinterval, 2.0 * interval)
+                        if status == 'closed':
+                            interval = maxinterval
+                    polls[(progid, run)] = [interval, now + interval]
+                if debug or verbose:
+                    print(strftime("%Y-%m-%dT%H:%M:%S", gmtime()), progid,
+                          'run files checked:', nchecked)
+
+                if not rebuild:
+                    continue
+                try:
+                    # the session may have expired since the last rebuild
+                    tlogin = time.time()
+                    opener = login_session(sessionfile, verbose=verbose,
+                                           debug=debug)
+                    tlogin = time.time() - tlogin
+                    process_program(opener, progid, outpath_root, args, date,
+                                    historydb=program['historydb'],
+                                    tables=tables[progid], login=tlogin)
+                    built[progid] = date
+                    discovered[progid] = time.time()
+                except Exception as err:
+                    traceback.print_exc()
+                    print('Problem processing:', progid, err)
+                    failed = True
+
+            # sleep until the next poll is due, the next day or the
+            # retry of a failed rebuild
+            now = time.time()
+            wake = (int(now // 86400) + 1) * 86400
+            if polls:
+                wake = min(wake, min(nextpoll for interval, nextpoll
+                                     in polls.values()))
+            if failed or not polls:
+                wake = min(wake, now + mininterval)
+            if debug or verbose:
+                print('Next poll in', wake - now, 'seconds')
+            time.sleep(max(1.0, wake - now))
+
+    except KeyboardInterrupt:
+        print('Stopped watching')
+
+
+if __name__ == '__main__':
+
+    import os
+    import sys
+    import re
+    import string
+    import traceback
+    import time
+    from time import strftime, gmtime
+    from optparse import OptionParser
+
+    import ConfigParser
+
+    # numpy, astropy and matplotlib are imported by the functions that
+    # use them so a run with nothing to rebuild does not import them;
+    # see process_program and _pyplot
+
+    # use of MultipartPostHandler deprecated by DM in April 2019
+    # from MultipartPostHandler import MultipartPostHandler
+    # import MultipartPostHandler
+    # if debug:
+    # print('MultipartPostHandler.__file__:',
+    #      MultipartPostHandler.__file__)
+
+    append = False
+    date = False
+
+    # getargs overrides configfile values
+    args = getargs(verbose=False)
+    configfile = args.configfile
+    debug = args.debug
+    pause = args.pause
+    verbose = args.verbose
+
+    # plot stage started by process_program; see start_plots
+    if args.plots:
+        make_plots(args.plots, nprocs=args.plotprocs, density=args.density)
+        outpath = os.path.dirname(os.path.abspath(args.plots))
+        if args.plotsbuild:
+            record_build(args.plotsbuild, 'progress_*.png',
+                         args.plotsdigest, outpath)
+        if not args.nostore:
+            store_snapshot(os.path.dirname(outpath), outpath, debug=debug)
+        sys.exit(0)
+
+    # concatenate existing files by date
+    # append=1
+    # date='20120328'
+    # date='20120401'
+
+    start = time.time()
+
+    # the cfg file contains a password so it must be readonly
+    configfile = 'progresscsv.cfg'
+    security_check = _check_perms(configfile)
+
+    config = getconfig(configfile=configfile, debug=True)
+
+    USERNAME = config.get('vhs', 'username')
+    PASSWORD = config.get('vhs', 'password')
+    PROGRAM = config.get('vhs', 'program')
+    OUTPATH_ROOT = config.get('vhs', 'outpath')
+    if config.has_option('vhs', 'esourl'):
+        set_eso_url(config.get('vhs', 'esourl'))
+    # could get from configfile or command line
+    progid = PROGRAM
+
+    # OB history database; see history_query
+    historydb = os.path.join(OUTPATH_ROOT, 'progresscsv_history.sqlite')
+    if config.has_option('vhs', 'historydb'):
+        historydb = config.get('vhs', 'historydb')
+
+    if args.history:
+        rows = history_query(historydb, program=progid, obid=args.obid,
+                             runid=args.runid, status=args.status,
+                             since=args.since, until=args.until)
+        print('snapshot program OB_ID run_ID change OB_status Status_date')
+        for row in rows:
+            print(row['snapshot'], row['program'], row['ob_id'],
+                  row['run_id'], row['change'], row['ob_status'],
+                  row['status_date'])
+        print('Number of rows:', len(rows))
+        sys.exit(0)
+
+    if args.backfill:
+        backfill(OUTPATH_ROOT, progid, historydb, nworkers=args.nprocs,
+                 maxbytes=args.cachesize * 1024 * 1024,
+                 restart=args.restart)
+        sys.exit(0)
+
+    # no changes should be needed below
+    if not date:
+        date = strftime("%Y%m%d", gmtime())
+
+    # batch mode processes all the program sections of the config file
+    if args.batch:
+        programs = config_programs(config)
+        print('Programs:', [program['program'] for program in programs])
+
+    # authenticate to ESO portal once; reusing the saved session if valid
+    sessionfile = '~/.progresscsv_session'
+    if config.has_option('vhs', 'sessionfile'):
+        sessionfile = config.get('vhs', 'sessionfile')
+
+    if args.watch:
+        if not args.batch:
+            programs = [{'section': 'vhs', 'program': progid,
+                         'outpath': OUTPATH_ROOT, 'historydb': historydb}]
+        watch(sessionfile, programs, args, mininterval=args.interval,
+              maxinterval=args.maxinterval)
+        sys.exit(0)
+
+    tlogin = time.time()
+    opener = login_session(sessionfile, relogin=args.relogin,
+                           verbose=verbose, debug=debug, pause=pause)
+    tlogin = time.time() - tlogin
+
+    if not args.batch:
+        process_program(opener, progid, OUTPATH_ROOT, args, date,
+                        historydb=historydb, append=append, login=tlogin)
+        sys.exit(0)
 
+    results = run_programs(opener, programs, args, date, append=append,
+                           login=tlogin)
 
     end = time.time()
     elapsed = end - start
-    print("Elapsed time:", elapsed, "seconds")
-    print()
+    print_timings(results, elapsed=elapsed)
+
+    if [result for result in results if 'error' in result]:
+        sys.exit(1)
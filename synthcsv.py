@@ -0,0 +1,199 @@
+"""
+ Synthetic ESO progress csv files for testing and benchmarking
+
+ The files have the preamble line that ESO adds before the header, the
+ real column names (see progresscsv.PROGRESS_SCHEMA) and realistic
+ values: OB and OD names, sky transparency and container types of
+ varying width, some empty numeric values and a mix of OB status. Rows
+ are generated and written in chunks so files of millions of rows can
+ be made without holding them in memory.
+
+ Usage:
+
+ python synthcsv.py --program 198A2001 --runs A-O --nrows 100000 --outpath /tmp/synth
+
+ See also fakeeso.py and bench_micro.py
+
+"""
+
+from __future__ import print_function
+
+
+HEADER = ('run ID,OB ID,OB name,OB status,Status date,OD name,' +
+          'RA (hrs),DEC (deg),Execution time (s),Container type,' +
+          'Container ID,Seeing,Sky transparency,FLI\n')
+
+OB_STATUS = ['C', 'C', 'C', 'C', '+', 'P', 'D', 'M', 'X', 'K']
+TRANSPARENCY = ['Photometric', 'Clear', 'Thin cirrus', 'Thick cirrus',
+                'Variable']
+CONTAINER_TYPE = ['', '', 'C', 'G', 'T']
+SURVEY = ['VHS', 'VHS-GPS', 'VHS-ATLAS', 'VHS-DES-SGP', 'VHS-XXL']
+
+
+def run_range(runs):
+    """
+    expand a run specification e.g. 'A-O', 'ABD' or 'A-Z,AA,AB' into a
+    list of runs
+
+    """
+    import string
+
+    expanded = []
+    for part in runs.split(','):
+        part = part.strip()
+        if len(part) == 3 and part[1] == '-':
+            first = string.ascii_uppercase.index(part[0])
+            last = string.ascii_uppercase.index(part[2])
+            expanded += list(string.ascii_uppercase[first:last + 1])
+        elif len(part) > 1 and ',' not in runs:
+            expanded += list(part)
+        elif part:
+            expanded.append(part)
+
+    return expanded
+
+
+def run_obid(run):
+    """
+    first OB ID of a run so that OB IDs are unique across the runs of a
+    program
+
+    """
+    obid = 0
+    for c in run:
+        obid = 26 * obid + ord(c) - ord('A') + 1
+
+    return obid * 10000000
+
+
+def make_rows(program, run, nrows, seed=None, start=0):
+    """
+    make nrows data lines of a progress csv run file; row i of a run is
+    OB ID run_obid(run) + start + i
+
+    returns a list of lines
+
+    """
+    import random
+
+    rnd = random.Random(seed if seed is not None else program + run)
+    runid = program + run
+    obid = run_obid(run)
+
+    lines = []
+    for i in range(start, start + nrows):
+        survey = rnd.choice(SURVEY)
+        seeing = '' if rnd.random() < 0.02 else \
+            '%.1f' % rnd.choice([0.6, 0.8, 1.0, 1.2, 1.4])
+        lines.append(
+            '%s,%d,%s_%s_%06d%s,%s,%s,%s_OD_%d,%.6f,%.6f,%d,%s,%d,%s,%s,'
+            '%.2f\n' %
+            (runid, obid + i, survey, run, i, 'x' * rnd.randint(0, 12),
+             rnd.choice(OB_STATUS),
+             '20%02d-%02d-%02d %02d:%02d:%02d' %
+             (rnd.randint(10, 19), rnd.randint(1, 12), rnd.randint(1, 28),
+              rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59)),
+             survey, i // 50,
+             rnd.uniform(0.0, 24.0), rnd.uniform(-90.0, 10.0),
+             rnd.choice([300, 600, 1200, 1800, 3600]),
+             rnd.choice(CONTAINER_TYPE), rnd.randint(0, 99999), seeing,
+             rnd.choice(TRANSPARENCY), rnd.random()))
+
+    return lines
+
+
+def make_runfile(program, run, nrows, seed=None, start=0):
+    """
+    make the text of a progress csv run file with nrows OBs
+
+    returns the preamble and header lines and the data lines as two
+    lists
+
+    """
+    preamble = ['Progress report for run %s%s\n' % (program, run), HEADER]
+
+    return preamble, make_rows(program, run, nrows, seed=seed, start=start)
+
+
+def write_runfile(filename, program, run, nrows, chunksize=100000):
+    """
+    write a progress csv run file with nrows OBs in chunks of chunksize
+    rows via a temporary file
+
+    returns the number of bytes written
+
+    """
+    import os
+
+    with open(filename + '.tmp', 'w') as fh:
+        fh.write('Progress report for run %s%s\n' % (program, run))
+        fh.write(HEADER)
+        for start in range(0, nrows, chunksize):
+            fh.writelines(make_rows(program, run,
+                                    min(chunksize, nrows - start),
+                                    seed='%s%s%d' % (program, run, start),
+                                    start=start))
+        nbytes = fh.tell()
+    os.rename(filename + '.tmp', filename)
+
+    return nbytes
+
+
+def write_program(outpath, program, runs, nrows):
+    """
+    write the run files of a program with nrows OBs in total split
+    between the runs as outpath/<program><run>.csv
+
+    returns the list of filenames
+
+    """
+    import os
+
+    if not os.path.isdir(outpath):
+        os.makedirs(outpath)
+
+    filenames = []
+    for i, run in enumerate(runs):
+        # the first runs get the remainder
+        nrun = nrows // len(runs) + (1 if i < nrows % len(runs) else 0)
+        filename = os.path.join(outpath, program + run + '.csv')
+        write_runfile(filename, program, run, nrun)
+        filenames.append(filename)
+
+    return filenames
+
+
+def getargs():
+    """
+    parse command line arguements
+
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='write synthetic ESO progress csv files',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--program", default='198A2001',
+                        help="program ID")
+
+    parser.add_argument("--runs", default='A-O',
+                        help="runs e.g. A-O or A-Z,AA,AB")
+
+    parser.add_argument("--nrows", type=int, default=100000,
+                        help="total number of OBs")
+
+    parser.add_argument("--outpath", default='.',
+                        help="output directory")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    args = getargs()
+
+    filenames = write_program(args.outpath, args.program,
+                              run_range(args.runs), args.nrows)
+    for filename in filenames:
+        print('Written:', filename)
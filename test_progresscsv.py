@@ -0,0 +1,636 @@
+"""
+ Tests of the progresscsv.py table pipeline on synthetic progress csv
+ files (see synthcsv.py)
+
+ Usage:
+
+ python -m pytest test_progresscsv.py
+
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+import progresscsv
+import synthcsv
+
+
+def _runtable(run='A', nrows=500):
+    """
+    a parsed run table with some empty Seeing values and an empty
+    Status date
+
+    """
+    preamble, lines = synthcsv.make_runfile('198A2001', run, nrows)
+    table = progresscsv.read_progress_csv(preamble + lines)
+    table['Status date'][3] = np.datetime64('NaT')
+
+    return table
+
+
+def assert_tables_equal(table, other):
+    """
+    same columns, dtypes, masks and unmasked values; NaT equals NaT
+    and a masked date e.g. a null in parquet
+
+    """
+    assert table.colnames == other.colnames
+    for colname in table.colnames:
+        column = table[colname]
+        othercolumn = other[colname]
+        # FITS is big endian
+        assert column.dtype.newbyteorder('=') == \
+            othercolumn.dtype.newbyteorder('='), colname
+        if column.dtype.kind == 'M':
+            data = np.ma.filled(column, np.datetime64('NaT'))
+            otherdata = np.ma.filled(othercolumn, np.datetime64('NaT'))
+            assert ((data == otherdata) |
+                    (np.isnat(data) & np.isnat(otherdata))).all(), colname
+            continue
+        mask = np.ma.getmaskarray(column)
+        assert (mask == np.ma.getmaskarray(othercolumn)).all(), colname
+        data = np.ma.getdata(column)[~mask]
+        otherdata = np.ma.getdata(othercolumn)[~mask]
+        assert (data == otherdata).all(), colname
+
+
+def test_read_progress_csv_fallback():
+    import pytest
+
+    preamble, lines = synthcsv.make_runfile('198A2001', 'A', 20)
+    table = progresscsv.read_progress_csv(preamble + lines)
+
+    # a number in a string column keeps its text
+    fields = [line.split(',') for line in lines]
+    for row in fields:
+        row[2] = '007'
+    newtable = progresscsv.read_progress_csv(
+        preamble + [','.join(row) for row in fields])
+    assert (newtable['OB name'] == '007').all()
+    assert (newtable['OB ID'] == table['OB ID']).all()
+
+    fields[5][1] = '1.5'
+    with pytest.raises(ValueError) as excinfo:
+        progresscsv.read_progress_csv(
+            preamble + [','.join(row) for row in fields])
+    assert "'OB ID' line 8" in str(excinfo.value)
+
+    with pytest.raises(ValueError) as excinfo:
+        progresscsv.read_progress_csv(preamble + lines[:3] + ['1,2\n'])
+    assert 'Line 6 has 2 columns' in str(excinfo.value)
+
+
+def test_write_read_table_masked(tmpdir):
+    table = _runtable()
+    assert np.ma.getmaskarray(table['Seeing']).any()
+
+    fitsfile = str(tmpdir.join('198A2001A.fits'))
+    progresscsv.write_table(table, fitsfile)
+    assert_tables_equal(table, progresscsv.read_table(fitsfile))
+
+
+def test_cached_table_masked(tmpdir, monkeypatch):
+    preamble, lines = synthcsv.make_runfile('198A2001', 'A', 200)
+    fields = lines[0].split(',')
+    fields[11] = ''
+    lines[0] = ','.join(fields)
+    csvfile = tmpdir.join('198A2001A.csv')
+    csvfile.write(''.join(preamble + lines))
+    cachedir = str(tmpdir.join('tablecache'))
+
+    table = progresscsv.read_progress_cached(str(csvfile), cachedir)
+    assert np.ma.getmaskarray(table['Seeing']).any()
+    key = progresscsv.build_digest([progresscsv.file_hash(str(csvfile))])
+    assert_tables_equal(table, progresscsv.load_cached_table(cachedir, key))
+
+    # a hit is not parsed
+    monkeypatch.setattr(progresscsv, 'read_progress_csv', None)
+    assert_tables_equal(table,
+                        progresscsv.read_progress_cached(str(csvfile),
+                                                         cachedir))
+
+
+def test_cached_table_key_schema_version(tmpdir, monkeypatch):
+    preamble, lines = synthcsv.make_runfile('198A2001', 'A', 20)
+    csvfile = tmpdir.join('198A2001A.csv')
+    csvfile.write(''.join(preamble + lines))
+    cachedir = tmpdir.join('tablecache')
+
+    progresscsv.read_progress_cached(str(csvfile), str(cachedir))
+    keys = set(path.purebasename.split('_')[0]
+               for path in cachedir.listdir())
+    monkeypatch.setattr(progresscsv, 'SCHEMA_VERSION',
+                        progresscsv.SCHEMA_VERSION + 1)
+    progresscsv.read_progress_cached(str(csvfile), str(cachedir))
+    newkeys = set(path.purebasename.split('_')[0]
+                  for path in cachedir.listdir()) - keys
+    assert len(keys) == 1 and len(newkeys) == 1
+    assert newkeys.pop() == progresscsv.build_digest(
+        [progresscsv.file_hash(str(csvfile))])
+
+
+def test_evict_cache_lru(tmpdir):
+    import os
+    import time
+
+    cachedir = str(tmpdir)
+    table = _runtable(nrows=100)
+    for key in ['a', 'b', 'c']:
+        progresscsv.save_cached_table(cachedir, key, table)
+    entrysize = sum(path.size() for path in tmpdir.listdir()
+                    if path.purebasename.startswith('a'))
+    # a is the oldest but has just been used, so b is the least recent
+    now = time.time()
+    for age, key in [(300, 'a'), (200, 'b'), (100, 'c')]:
+        for path in tmpdir.listdir():
+            if path.purebasename.split('_')[0] == key:
+                os.utime(str(path), (now - age, now - age))
+    assert progresscsv.load_cached_table(cachedir, 'a') is not None
+
+    assert progresscsv.evict_cache(cachedir, 2 * entrysize) == 1
+    assert progresscsv.load_cached_table(cachedir, 'b') is None
+    assert progresscsv.load_cached_table(cachedir, 'c') is not None
+
+    assert progresscsv.evict_cache(cachedir, 0) == 2
+    assert tmpdir.listdir() == []
+
+
+def test_compute_delta_fits(tmpdir):
+    oldtable = _runtable()
+    fitsfile = str(tmpdir.join('198A2001.fits'))
+    progresscsv.write_table(oldtable, fitsfile)
+    oldtable = progresscsv.read_table(fitsfile)
+    assert oldtable.masked
+
+    table = _runtable(nrows=501)[1:]
+    table['OB status'][0] = 'Z'
+    table['Status date'][1] = np.datetime64('2001-01-01T00:00:00')
+
+    delta = progresscsv.compute_delta(table, oldtable)
+    changes = dict(zip(delta['OB ID'], delta['change']))
+    obid = synthcsv.run_obid('A')
+    assert changes == {obid: 'removed', obid + 1: 'status',
+                       obid + 2: 'date', obid + 500: 'new'}
+
+
+def test_write_empty_delta(tmpdir):
+    table = _runtable()
+    delta = progresscsv.compute_delta(table, table)
+    progresscsv.write_delta(delta, str(tmpdir.join('delta')))
+    progresscsv.write_empty_delta(str(tmpdir.join('empty')))
+
+    for ext in ['.csv', '.jsonl']:
+        assert tmpdir.join('empty' + ext).read() == \
+            tmpdir.join('delta' + ext).read()
+    empty = progresscsv.read_table(str(tmpdir.join('empty.fits')))
+    assert empty.colnames == delta.colnames
+    assert len(empty) == 0
+
+
+def test_history_append_rerun(tmpdir):
+    oldtable = _runtable()
+    table = _runtable()
+    table['OB status'][0] = 'Z'
+    obid = synthcsv.run_obid('A')
+
+    historydb = str(tmpdir.join('history.sqlite'))
+    delta = progresscsv.compute_delta(table, oldtable)
+    assert progresscsv.history_append(historydb, '198A2001', '20190101',
+                                      delta) == 1
+    assert progresscsv.history_query(historydb, obid=obid,
+                                     status='Z')[0]['snapshot'] == '20190101'
+
+    # corrected upstream and the snapshot is rebuilt the same day
+    delta = progresscsv.compute_delta(oldtable, oldtable)
+    assert progresscsv.history_append(historydb, '198A2001', '20190101',
+                                      delta) == 0
+    assert progresscsv.history_query(historydb, obid=obid) == []
+
+
+def _baseline_snapshot(snapshot, lines):
+    """
+    write a summary FITS file the way the baseline script did: astropy
+    ascii format guessing of the csv and Table.write
+
+    """
+    from astropy.table import Table
+
+    snapshot.ensure(dir=True)
+    table = Table.read(lines, format='ascii', data_start=2,
+                       header_start=1)
+    table.write(str(snapshot.join('198A2001.fits')), overwrite=True)
+
+
+def test_backfill_baseline_fits(tmpdir):
+    preamble, lines = synthcsv.make_runfile('198A2001', 'A', 200)
+    # an empty Seeing value so the FITS table is masked
+    fields = lines[0].split(',')
+    fields[11] = ''
+    lines[0] = ','.join(fields)
+    _baseline_snapshot(tmpdir.join('20190101'), preamble + lines)
+    fields = lines[5].split(',')
+    fields[3] = 'Z' if fields[3] != 'Z' else 'Y'
+    lines[5] = ','.join(fields)
+    _baseline_snapshot(tmpdir.join('20190102'), preamble + lines)
+    tmpdir.join('20190103').ensure(dir=True)
+
+    historydb = str(tmpdir.join('history.sqlite'))
+    nloaded = progresscsv.backfill(str(tmpdir), '198A2001', historydb,
+                                   nworkers=2)
+    assert nloaded == 2
+
+    rows = progresscsv.history_query(historydb, since='20190102')
+    assert [(row['ob_id'], row['change']) for row in rows] == \
+        [(int(fields[1]), 'status')]
+
+
+def test_backfill_stops_at_unreadable_snapshot(tmpdir):
+    import json
+
+    preamble, lines = synthcsv.make_runfile('198A2001', 'A', 50)
+    _baseline_snapshot(tmpdir.join('20190101'), preamble + lines)
+    tmpdir.join('20190102').ensure(dir=True).join(
+        '198A2001.fits').write('not a FITS file')
+    _baseline_snapshot(tmpdir.join('20190103'), preamble + lines)
+
+    historydb = str(tmpdir.join('history.sqlite'))
+    assert progresscsv.backfill(str(tmpdir), '198A2001', historydb,
+                                nworkers=1) == 1
+    checkpointfile = tmpdir.join('198A2001_backfill.json')
+    assert json.loads(checkpointfile.read())['last'] == '20190101'
+
+    # fixed and resumed
+    _baseline_snapshot(tmpdir.join('20190102'), preamble + lines)
+    assert progresscsv.backfill(str(tmpdir), '198A2001', historydb,
+                                nworkers=1) == 2
+    assert json.loads(checkpointfile.read())['last'] == '20190103'
+
+
+def _record_builds(args):
+    buildfile, name = args
+    for i in range(20):
+        progresscsv.record_build(buildfile, '%s%d' % (name, i), name, name)
+
+
+def test_record_build_concurrent(tmpdir):
+    from multiprocessing import Pool
+
+    buildfile = str(tmpdir.join('198A2001_build.json'))
+    pool = Pool(4)
+    try:
+        pool.map(_record_builds, [(buildfile, name) for name in 'abcd'])
+    finally:
+        pool.close()
+        pool.join()
+
+    build = progresscsv.load_validators(buildfile)
+    assert len(build) == 80
+    assert build['c7'] == {'inputs': 'c', 'outpath': 'c'}
+    assert not [path for path in tmpdir.listdir()
+                if path.basename.endswith('.tmp')]
+
+
+def test_store_snapshot(tmpdir, monkeypatch):
+    import os
+    import json
+    import hashlib
+
+    def _object(digest):
+        return tmpdir.join('objects', digest[:2], digest)
+
+    first = tmpdir.join('20190101').ensure(dir=True)
+    first.join('198A2001A.csv').write('run A\n')
+    first.join('198A2001B.csv').write('run B\n')
+    manifest = progresscsv.store_snapshot(str(tmpdir), str(first))
+    assert json.loads(first.join('MANIFEST.json').read()) == manifest
+    assert sorted(manifest) == ['198A2001A.csv', '198A2001B.csv']
+    for filename, entry in manifest.items():
+        assert entry['sha256'] == \
+            hashlib.sha256(first.join(filename).read()).hexdigest()
+        assert entry['size'] == 6
+        assert os.path.samefile(str(first.join(filename)),
+                                str(_object(entry['sha256'])))
+
+    # A is linked from the first snapshot and B has changed
+    second = tmpdir.join('20190102').ensure(dir=True)
+    os.link(str(first.join('198A2001A.csv')),
+            str(second.join('198A2001A.csv')))
+    second.join('198A2001B.csv').write('run B changed\n')
+
+    hashed = []
+    file_hash = progresscsv.file_hash
+    monkeypatch.setattr(progresscsv, 'file_hash',
+                        lambda filename: hashed.append(filename) or
+                        file_hash(filename))
+    newmanifest = progresscsv.store_snapshot(str(tmpdir), str(second))
+    assert hashed == [str(second.join('198A2001B.csv'))]
+    assert newmanifest['198A2001A.csv'] == manifest['198A2001A.csv']
+    digest = newmanifest['198A2001B.csv']['sha256']
+    assert digest != manifest['198A2001B.csv']['sha256']
+    assert os.path.samefile(str(second.join('198A2001B.csv')),
+                            str(_object(digest)))
+    assert first.join('198A2001B.csv').read() == 'run B\n'
+    assert len([path for path in tmpdir.join('objects').visit()
+                if path.isfile()]) == 3
+
+
+def _fakeeso(**kwargs):
+    """
+    a FakeESO with runs A-C of 198A2001 and an opener logged in to it
+
+    """
+    import fakeeso
+
+    server = fakeeso.start_server(programs=['198A2001'], runs=['A', 'B', 'C'],
+                                  nrows=20, **kwargs)
+    progresscsv.set_eso_url(server.url)
+    progresscsv.USERNAME = 'fake'
+    progresscsv.PASSWORD = 'fake'
+
+    return server, progresscsv.login()
+
+
+def _fake_stats(server):
+    """
+    the request counts of a FakeESO
+
+    """
+    import json
+    import urllib2
+
+    return json.loads(urllib2.urlopen(server.url + '/_fake/stats').read())
+
+
+def test_login_session(tmpdir):
+    import os
+    import stat
+    import urllib2
+
+    server, opener = _fakeeso()
+    sessionfile = str(tmpdir.join('session'))
+    try:
+        progresscsv.login_session(sessionfile)
+        assert stat.S_IMODE(os.stat(sessionfile).st_mode) == 0o600
+
+        # reused with a single check request
+        counts = _fake_stats(server)
+        opener = progresscsv.login_session(sessionfile)
+        newcounts = _fake_stats(server)
+        assert newcounts.pop('session_check') == \
+            counts.pop('session_check', 0) + 1
+        assert newcounts == counts
+        opener.open(progresscsv.CSV_URL + '198A2001A.csv').read()
+
+        # expired so logs in again
+        urllib2.urlopen(server.url + '/_fake/expire').read()
+        counts = _fake_stats(server)
+        opener = progresscsv.login_session(sessionfile)
+        newcounts = _fake_stats(server)
+        assert newcounts['login'] == counts['login'] + 1
+        assert newcounts['session_check'] == counts['session_check'] + 1
+        assert stat.S_IMODE(os.stat(sessionfile).st_mode) == 0o600
+        opener.open(progresscsv.CSV_URL + '198A2001A.csv').read()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _progress_args(*argv):
+    """
+    progresscsv command line arguments
+
+    """
+    import sys
+
+    sysargv = sys.argv
+    sys.argv = ['progresscsv.py'] + list(argv)
+    try:
+        return progresscsv.getargs()
+    finally:
+        sys.argv = sysargv
+
+
+def test_conditional_download(tmpdir, monkeypatch):
+    import os
+    import urllib2
+
+    server, opener = _fakeeso()
+    args = _progress_args('--nostore', '--cachesize', '0',
+                          '--closed-days', '1e9')
+    outpath_root = str(tmpdir)
+    try:
+        progresscsv.process_program(opener, '198A2001', outpath_root, args,
+                                    '20190101')
+        for process in progresscsv.PLOT_PROCESSES:
+            process.wait()
+        counts = _fake_stats(server)
+
+        urllib2.urlopen(server.url + '/_fake/touch/198A2001B').read()
+        parsed = []
+        read_progress_csv = progresscsv.read_progress_csv
+        monkeypatch.setattr(progresscsv, 'read_progress_csv',
+                            lambda infile, **kwargs: parsed.append(infile) or
+                            read_progress_csv(infile, **kwargs))
+        metrics = progresscsv.process_program(opener, '198A2001',
+                                              outpath_root, args, '20190102')
+        for process in progresscsv.PLOT_PROCESSES:
+            process.wait()
+        newcounts = _fake_stats(server)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert newcounts.get('csv_304', 0) == counts.get('csv_304', 0) + 2
+    assert [metrics['runs'][run]['status'] for run in 'ABC'] == \
+        [304, 200, 304]
+    assert len(parsed) == 1
+
+    first = tmpdir.join('20190101')
+    second = tmpdir.join('20190102')
+    for run in 'AC':
+        for ext in ['.csv', '.fits']:
+            filename = '198A2001' + run + ext
+            assert os.path.samefile(str(first.join(filename)),
+                                    str(second.join(filename)))
+    assert not os.path.samefile(str(first.join('198A2001B.csv')),
+                                str(second.join('198A2001B.csv')))
+
+
+def test_discover_runs_without_head():
+    server, opener = _fakeeso(nohead=True)
+    try:
+        runindex = {}
+        live, closed = progresscsv.discover_runs(opener, '198A2001',
+                                                 runindex)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert (live, closed) == (['A', 'B', 'C'], [])
+    assert sorted(runindex) == ['A', 'B', 'C', 'D', 'E', 'F']
+    assert [runindex[run]['status'] for run in 'DEF'] == ['missing'] * 3
+
+
+def test_discover_runs_reopens_closed_run():
+    import time
+    import urllib2
+
+    server, opener = _fakeeso()
+    try:
+        runindex = {}
+        progresscsv.discover_runs(opener, '198A2001', runindex)
+        runfile = server.runfiles['198A2001A']
+        for run in 'ABC':
+            runindex[run] = {'status': 'closed', 'checked': 0,
+                             'last_modified':
+                                 server.runfiles['198A2001' + run]
+                                 .last_modified}
+        validators = {'A': {'etag': runfile.etag}}
+        urllib2.urlopen(server.url + '/_fake/touch/198A2001A').read()
+
+        live, closed = progresscsv.discover_runs(
+            opener, '198A2001', runindex, validators=validators)
+        assert (live, closed) == (['A'], ['B', 'C'])
+        assert runindex['B']['checked'] > time.time() - 60
+
+        # checked recently so no requests
+        runindex['A']['status'] = 'closed'
+        runindex['A']['checked'] = time.time()
+        live, closed = progresscsv.discover_runs(opener, '198A2001',
+                                                 runindex)
+        assert (live, closed) == ([], ['A', 'B', 'C'])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_check_run_missing():
+    server, opener = _fakeeso()
+    try:
+        runindex = {}
+        progresscsv.discover_runs(opener, '198A2001', runindex)
+        url = progresscsv.CSV_URL + '198A2001C.csv'
+        validator = {'etag': server.runfiles['198A2001C'].etag}
+        assert progresscsv.check_run(opener, url, validator) is False
+
+        del server.runfiles['198A2001C']
+        assert progresscsv.check_run(opener, url, validator) == 'missing'
+
+        runindex['C'].update({'status': 'closed', 'checked': 0})
+        live, closed = progresscsv.discover_runs(opener, '198A2001',
+                                                 runindex)
+        assert (live, closed) == (['A', 'B'], [])
+        assert runindex['C'] == {'status': 'missing'}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_fetch_runs_demotes_missing_run(tmpdir):
+    server, opener = _fakeeso()
+    try:
+        runindex = dict((run, {'status': 'live'}) for run in 'ABCF')
+        live, closed = progresscsv.discover_runs(opener, '198A2001',
+                                                 runindex)
+        assert live == ['A', 'B', 'C', 'F']
+        fetched, missing = progresscsv.fetch_runs(
+            opener, '198A2001', live, str(tmpdir), stop_on_missing=False)
+        progresscsv.update_runindex(runindex, fetched, missing=missing,
+                                    closed_days=1e6)
+
+        assert [run for run, info in fetched] == ['A', 'B', 'C']
+        assert missing == ['F']
+        assert runindex['F'] == {'status': 'missing'}
+
+        live, closed = progresscsv.discover_runs(opener, '198A2001',
+                                                 runindex)
+        assert live == ['A', 'B', 'C']
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_columnar_masked(tmpdir):
+    table = _runtable()
+    for outformat, ext in sorted(progresscsv.COLUMNAR_FORMATS.items()):
+        filename = str(tmpdir.join('198A2001A' + ext))
+        progresscsv.write_columnar(table, filename, outformat)
+        assert_tables_equal(table, progresscsv.read_columnar(filename))
+
+        columns = ['OB ID', 'Seeing']
+        assert_tables_equal(table[columns],
+                            progresscsv.read_columnar(filename, columns))
+
+
+def test_from_arrow_chunks():
+    import pyarrow as pa
+
+    table = _runtable(nrows=50)
+    # wider in the first chunk than in the second
+    table['OB status'] = table['OB status'].astype('S3')
+    table['OB status'][4] = 'XYZ'
+    atable = progresscsv._to_arrow(table)
+    # sliced chunks have offsets into their buffers
+    atable = pa.Table.from_arrays(
+        [pa.chunked_array([column.chunk(0).slice(0, 7),
+                           column.chunk(0).slice(7)])
+         for column in atable.columns], names=atable.column_names)
+    newtable = progresscsv._from_arrow(atable)
+    newtable['Status date'] = progresscsv._datetime_column(
+        newtable['Status date'], 'M8[s]')
+    assert_tables_equal(table, newtable)
+
+
+def test_fakeeso_port_in_use():
+    import socket
+    import fakeeso
+    import pytest
+
+    server = fakeeso.start_server(programs=['198A2001'], runs=['A'])
+    try:
+        with pytest.raises(socket.error):
+            fakeeso.start_server(port=server.server_address[1],
+                                 programs=['198A2001'], runs=['A'])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_make_plots_masked_summary(tmpdir):
+    import os
+
+    fitsfile = str(tmpdir.join('198A2001.fits'))
+    progresscsv.write_table(
+        progresscsv.stack_tables([_runtable('A'), _runtable('B')]),
+        fitsfile)
+
+    figfiles = progresscsv.make_plots(fitsfile, nprocs=2)
+    assert str(tmpdir.join('progress_radec.png')) in figfiles
+    assert str(tmpdir.join('progress_radec_run_198A2001B.png')) in figfiles
+    for figfile in figfiles:
+        assert os.path.getsize(figfile) > 0
+
+
+def test_plot_stage_records_build(tmpdir):
+    import subprocess
+    import sys
+
+    snapshot = tmpdir.join('20190101').ensure(dir=True)
+    fitsfile = str(snapshot.join('198A2001.fits'))
+    progresscsv.write_table(_runtable(), fitsfile)
+    buildfile = str(tmpdir.join('198A2001_build.json'))
+
+    # a failed plot stage records nothing
+    assert subprocess.call([sys.executable, progresscsv.__file__.replace(
+        '.pyc', '.py'), '--plots', str(snapshot.join('missing.fits')),
+        '--nostore', '--plotsbuild', buildfile,
+        '--plotsdigest', 'abc']) != 0
+    assert not tmpdir.join('198A2001_build.json').check()
+
+    assert subprocess.call([sys.executable, progresscsv.__file__.replace(
+        '.pyc', '.py'), '--plots', fitsfile, '--plotprocs', '1',
+        '--nostore', '--plotsbuild', buildfile,
+        '--plotsdigest', 'abc']) == 0
+    assert progresscsv.load_validators(buildfile)['progress_*.png'] == \
+        {'inputs': 'abc', 'outpath': str(snapshot)}